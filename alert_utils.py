@@ -0,0 +1,271 @@
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+import requests
+
+import metrics_utils
+
+EMAIL_ENDPOINT = os.getenv('ALERT_EMAIL_ENDPOINT', 'http://localhost:5000/send-email')
+SPOOL_DIR = os.getenv('ALERT_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alert_spool'))
+# seconds per email delivery attempt; /send-email may take EMAILJS_TIMEOUT for the
+# EmailJS call, and timing out before it answers would retry, and send, the same
+# email twice
+EMAIL_REQUEST_TIMEOUT = float(os.getenv('ALERT_EMAIL_TIMEOUT', '30'))
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2        # seconds before the first retry, doubled on every attempt
+BACKOFF_MAX = 300
+
+logger = logging.getLogger(__name__)
+
+alert_attempts = metrics_utils.counter('campuseye_alert_attempts', 'Alert delivery attempts by outcome', ['kind', 'outcome'])
+alerts_pending = metrics_utils.gauge('campuseye_alerts_pending', 'Spooled alerts waiting for delivery or a retry')
+
+
+class AlertError(Exception):
+    pass
+
+
+_capture_uploader = None
+_capture_uploader_lock = threading.Lock()
+
+
+def captureUploader():
+    """media_utils.MediaUploader for alert captures, created on first use."""
+    global _capture_uploader
+    with _capture_uploader_lock:
+        if _capture_uploader is None:
+            import media_utils
+            _capture_uploader = media_utils.MediaUploader()
+        return _capture_uploader
+
+
+def send_email_alert(payload, image_bytes, endpoint=None):
+    payload = dict(payload)
+    if image_bytes is not None:
+        # Upload the capture here on the dispatcher thread, so /send-email only
+        # calls EmailJS. A retried alert finds the finished upload in the cache.
+        uploader = captureUploader()
+        try:
+            payload['photoUrl'] = uploader.submit(uploader.store(image_bytes)).result()
+        except Exception as e:
+            logger.warning('Capture upload failed, emailing the enrolled photo: %s', e)
+    response = requests.post(endpoint or EMAIL_ENDPOINT, json=payload, timeout=EMAIL_REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise AlertError(f'email endpoint returned {response.status_code}')
+    try:
+        ok = response.json().get('success', True)
+    except ValueError:
+        ok = True
+    if not ok:
+        raise AlertError(f'email endpoint reported failure: {response.text}')
+
+
+def send_telegram_alert(payload, image_bytes):
+    import telegram_utils  # builds the bot on import; only needed when telegram alerts are used
+    if not telegram_utils.send_alert(payload['caption'], image_bytes):
+        raise AlertError('telegram send failed')
+
+
+SENDERS = {
+    'email': send_email_alert,
+    'telegram': send_telegram_alert
+}
+
+
+class AlertDispatcher:
+    """
+    Delivers alerts from a background worker so recognition threads never
+    wait on Cloudinary, EmailJS or Telegram.
+
+    Each alert is written to the spool directory before it is queued and
+    removed once delivered (or given up on), so pending alerts survive a
+    restart. Failed sends are retried with exponential backoff up to
+    `max_attempts` times.
+    """
+
+    def __init__(self, spool_dir=SPOOL_DIR, senders=None, max_attempts=MAX_ATTEMPTS,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, on_give_up=None):
+        self.spool_dir = spool_dir
+        self.senders = dict(SENDERS, **(senders or {}))
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_give_up = on_give_up     # called with the alert dict after the last failed attempt
+        self.cond = threading.Condition()
+        self.heap = []                   # (next_attempt, seq, alert)
+        self.seq = 0
+        self.delivering = 0
+        self.running = False
+        self._thread = None
+
+        self.sent = 0
+        self.failed_attempts = 0
+        self.given_up = 0
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._load_spool()
+
+    # ---------- spool ----------
+
+    def _path(self, alert_id, ext):
+        return os.path.join(self.spool_dir, f'{alert_id}.{ext}')
+
+    def _write_spool(self, alert):
+        tmp = self._path(alert['id'], 'json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(alert, f)
+        os.replace(tmp, self._path(alert['id'], 'json'))
+
+    def _remove_spool(self, alert):
+        for ext in ('json', 'jpg'):
+            try:
+                os.remove(self._path(alert['id'], ext))
+            except FileNotFoundError:
+                pass
+
+    def _load_spool(self):
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name)) as f:
+                    alert = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning('Skipping unreadable spooled alert %s: %s', name, e)
+                continue
+            alert['next_attempt'] = 0  # retry immediately after a restart
+            self._push(alert)
+        if self.heap:
+            logger.info('Recovered %d pending alert(s) from %s', len(self.heap), self.spool_dir)
+
+    # ---------- queue ----------
+
+    def _push(self, alert):
+        self.seq += 1
+        heapq.heappush(self.heap, (alert['next_attempt'], self.seq, alert))
+        alerts_pending.set(len(self.heap))
+
+    def enqueue(self, kind, payload, image_bytes=None):
+        """Persist an alert and hand it to the worker. Returns immediately."""
+        if kind not in self.senders:
+            raise ValueError(f"Unknown alert kind '{kind}'")
+        alert = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'payload': payload,
+            'has_image': image_bytes is not None,
+            'attempts': 0,
+            'next_attempt': 0,
+            'created_at': time.time()
+        }
+        if image_bytes is not None:
+            with open(self._path(alert['id'], 'jpg'), 'wb') as f:
+                f.write(image_bytes)
+        self._write_spool(alert)
+        with self.cond:
+            self._push(alert)
+            self.cond.notify()
+        return alert['id']
+
+    def waitIdle(self, timeout=None):
+        """Block until no alert is queued or being sent. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.cond:
+                if not self.heap and not self.delivering:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def pending(self):
+        with self.cond:
+            return len(self.heap)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'pending': len(self.heap),
+                'sent': self.sent,
+                'failed_attempts': self.failed_attempts,
+                'given_up': self.given_up
+            }
+
+    # ---------- worker ----------
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.heap or self.heap[0][0] > time.time()):
+                    timeout = self.heap[0][0] - time.time() if self.heap else None
+                    self.cond.wait(timeout)
+                if not self.running:
+                    return
+                _, _, alert = heapq.heappop(self.heap)
+                self.delivering += 1
+            try:
+                self._deliver(alert)
+            finally:
+                with self.cond:
+                    self.delivering -= 1
+                    alerts_pending.set(len(self.heap) + self.delivering)
+
+    def _deliver(self, alert):
+        image_bytes = None
+        if alert['has_image']:
+            try:
+                with open(self._path(alert['id'], 'jpg'), 'rb') as f:
+                    image_bytes = f.read()
+            except OSError:
+                pass
+
+        alert['attempts'] += 1
+        try:
+            with metrics_utils.timed('alert'):
+                self.senders[alert['kind']](alert['payload'], image_bytes)
+        except Exception as e:
+            logger.warning('Alert %s attempt %d failed: %s', alert['kind'], alert['attempts'], e)
+            alert_attempts.inc(kind=alert['kind'], outcome='failed')
+            with self.cond:
+                self.failed_attempts += 1
+            if alert['attempts'] >= self.max_attempts:
+                logger.error('Giving up on %s alert after %d attempts', alert['kind'], alert['attempts'])
+                alert_attempts.inc(kind=alert['kind'], outcome='given_up')
+                self._remove_spool(alert)
+                with self.cond:
+                    self.given_up += 1
+                if self.on_give_up is not None:
+                    self.on_give_up(alert)
+                return
+            alert['next_attempt'] = time.time() + self._backoff(alert['attempts'])
+            self._write_spool(alert)
+            with self.cond:
+                self._push(alert)
+            return
+
+        self._remove_spool(alert)
+        alert_attempts.inc(kind=alert['kind'], outcome='sent')
+        with self.cond:
+            self.sent += 1
+        logger.info('%s alert sent', alert['kind'].capitalize())
@@ -1,18 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, make_response, g, send_file, abort
 import cv2
 import numpy as np
 from dotenv import load_dotenv
-import cloudinary
-from cloudinary.uploader import upload
-from cloudinary.exceptions import Error as CloudinaryError
+from markupsafe import Markup
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
 import os
+import logging
+import time
 import requests
-from io import StringIO, BytesIO
+from io import StringIO
+import zlib
+import zipfile
+import tempfile
+import threading
+import uuid
 import csv
-import pandas as pd  # Required for Chatbot
+from datetime import datetime, timedelta
 
 import mongo_utils
 import model_utils
+import chat_utils
+import cache_utils
+import enroll_utils
+import media_utils
+import metrics_utils
 
 # --------------------------------------------------
 # Load environment variables
@@ -22,28 +33,185 @@ if not os.path.exists(env_path):
     raise RuntimeError(".env file not found")
 
 load_dotenv(env_path)
-print(".env loaded successfully")
+metrics_utils.setupLogging()
+logger = logging.getLogger(__name__)
+logger.info(".env loaded successfully")
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret")
 
-# Cloudinary Config
-cloudinary.config(
-    cloud_name=os.getenv("CLOUD_NAME"),
-    api_key=os.getenv("API_KEY"),
-    api_secret=os.getenv("API_SECRET")
-)
+# Chatbot answers from indexed queries instead of loading all detections
+chat_engine = chat_utils.ChatEngine()
+
+# Photos are cached locally and pushed to Cloudinary in the background;
+# requests only wait for validation, embedding and the database write
+media_uploader = media_utils.MediaUploader()
+EMAILJS_TIMEOUT = 10   # seconds; keep under alert_utils.EMAIL_REQUEST_TIMEOUT
+
+# --------------------------------------------------
+# Metrics
+# --------------------------------------------------
+
+http_requests = metrics_utils.counter('campuseye_http_requests', 'HTTP requests by endpoint and status', ['endpoint', 'status'])
+http_request_seconds = metrics_utils.histogram('campuseye_http_request_seconds', 'HTTP request latency by endpoint', ['endpoint'])
+listing_cache_entries = metrics_utils.gauge('campuseye_listing_cache_entries', 'Cached student listing pages')
+listing_cache_lookups = metrics_utils.counter('campuseye_listing_cache_lookups', 'Student listing cache lookups', ['result'])
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    started = g.pop('request_started', None)
+    endpoint = request.endpoint or 'unknown'
+    if started is not None and endpoint != 'metrics':
+        # streamed responses (report downloads) are timed up to their first byte
+        http_request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+    http_requests.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    cache = student_list_cache.stats()
+    listing_cache_entries.set(cache['entries'])
+    listing_cache_lookups.sync(cache['hits'], result='hit')
+    listing_cache_lookups.sync(cache['misses'], result='miss')
+    return Response(metrics_utils.render(), mimetype=metrics_utils.PROMETHEUS_CONTENT_TYPE)
+
 
 # --------------------------------------------------
 # Routes
 # --------------------------------------------------
 
+STUDENTS_PER_PAGE = 25
+MAX_PER_PAGE = 200
+
+# Rendered student listings; cleared whenever a student is added, edited or deleted
+student_list_cache = cache_utils.TTLCache(ttl=300, max_entries=256)
+
+
+def _listing_args():
+    page = max(request.args.get('page', 1, type=int) or 1, 1)
+    per_page = request.args.get('per_page', STUDENTS_PER_PAGE, type=int) or STUDENTS_PER_PAGE
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+    search = request.args.get('q', '').strip() or None
+    return page, per_page, search
+
+
+def _student_page(page, per_page, search):
+    def load():
+        students, total = mongo_utils.listStudents(page, per_page, search)
+        return {'students': students, 'total': total, 'pages': max(1, -(-total // per_page))}
+    return student_list_cache.getOrCompute(('data', page, per_page, search), load)
+
+
+def _conditional(response):
+    # Browsers polling an unchanged listing get a 304 instead of the full body
+    response.add_etag()
+    return response.make_conditional(request)
+
+
 @app.route('/')
 def index():
-    students_list = list(
-        mongo_utils.students_collection.find({}, {'_id': 0, 'embedding': 0})
-    )
-    return render_template('index.html', students_list=students_list)
+    page, per_page, search = _listing_args()
+
+    def render_table():
+        data = _student_page(page, per_page, search)
+        return Markup(render_template(
+            '_student_table.html',
+            students_list=data['students'],
+            page=page,
+            pages=data['pages'],
+            total=data['total'],
+            search=search
+        ))
+
+    students_table = student_list_cache.getOrCompute(('html', page, per_page, search), render_table)
+    return _conditional(make_response(render_template('index.html', students_table=students_table)))
+
+
+@app.route('/api/students')
+def list_students():
+    page, per_page, search = _listing_args()
+    data = _student_page(page, per_page, search)
+    return _conditional(jsonify({
+        'students': data['students'],
+        'total': data['total'],
+        'page': page,
+        'per_page': per_page,
+        'pages': data['pages']
+    }))
+
+
+MAX_ENROLL_PHOTOS = 10  # templates stored per student from the enrollment form
+
+
+def _embed_photos(photos):
+    """
+    One template per photo with a clear face. Returns (templates, bytes of the
+    photo the first template came from); that photo becomes the student's photoUrl.
+    """
+    templates = []
+    first = None
+    for photo in photos[:MAX_ENROLL_PHOTOS]:
+        data = photo.read()
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        embedding = model_utils.getEmbedding(img) if img is not None else None
+        if embedding is None:
+            continue
+        templates.append(embedding)
+        if first is None:
+            first = data
+    return templates, first
+
+
+def _photo_uploaded(student_id, url):
+    student_list_cache.clear()
+
+
+def _photo_url(data, previous=None):
+    """
+    Returns (digest, URL to store now, pending) for a student photo. The URL is
+    the remote one if these bytes were uploaded before. Otherwise the photo is
+    pending and the URL is media_utils.pendingUrl, falling back to `previous`
+    (the student's last uploaded photo, if any); _queue_photo_upload's upload
+    replaces it once done.
+    """
+    digest = media_utils.digestOf(data)
+    url = media_uploader.cache.remoteUrl(digest)
+    if url is not None:
+        return digest, url, False
+    return digest, media_utils.pendingUrl(digest) or previous, True
+
+
+def _queue_photo_upload(student_id, data):
+    """Cache the photo and upload it; only called once the student document references it."""
+    digest = media_uploader.store(data)
+    media_uploader.submit(digest, media_utils.studentPhotoUpdater(
+        mongo_utils.students_collection, student_id, digest, _photo_uploaded
+    ))
+
+
+@app.route('/media/<digest>.jpg')
+def cached_media(digest):
+    """Serves photos whose upload is still pending."""
+    if not media_utils.isDigest(digest) or not media_uploader.cache.has(digest):
+        abort(404)
+    response = send_file(media_uploader.cache.path(digest), mimetype='image/jpeg')
+    # the name is the content hash, so the bytes never change
+    response.cache_control.public = True
+    response.cache_control.max_age = 7 * 24 * 3600
+    return response
+
+
+def _photos_message(action, templates, photos):
+    if len(templates) < len(photos):
+        return f'Student {action} successfully ({len(templates)} of {len(photos)} photos had a clear face)'
+    return f'Student {action} successfully'
 
 
 @app.route('/add-student', methods=['GET', 'POST'])
@@ -54,42 +222,133 @@ def add_student():
     name = request.form['name']
     student_id = request.form['student_id']
     branch = request.form['branch']
-    photo = request.files['photo']
+    photos = [p for p in request.files.getlist('photo') if p.filename]
 
-    if photo.filename == '':
+    if not photos:
         flash('Empty photo file', 'error')
         return redirect(url_for('add_student'))
 
-    try:
-        upload_result = upload(photo)
-        photo_url = upload_result['secure_url']
+    # until the unique index is confirmed, don't rely on the insert alone
+    if not mongo_utils.studentIdIsUnique() and mongo_utils.students_collection.find_one({'studentId': student_id}):
+        flash('Student ID already exists.', 'error')
+        return redirect(url_for('add_student'))
 
-        photo.seek(0)
-        img = cv2.imdecode(np.frombuffer(photo.read(), np.uint8), cv2.IMREAD_COLOR)
-        embedding = model_utils.getEmbedding(img)
+    # several photos give several templates; matching uses the closest one
+    templates, photo = _embed_photos(photos)
 
-        if embedding is None:
-            flash('Clear face not detected. Upload a better photo.', 'error')
-            return redirect(url_for('add_student'))
+    if not templates:
+        flash('Clear face not detected. Upload a better photo.', 'error')
+        return redirect(url_for('add_student'))
 
-        if mongo_utils.students_collection.find_one({'studentId': student_id}):
-            flash('Student ID already exists.', 'error')
-            return redirect(url_for('add_student'))
+    photo_hash, photo_url, photo_pending = _photo_url(photo)
 
+    # the unique studentId index rejects duplicates in the same round trip
+    try:
         mongo_utils.students_collection.insert_one({
             'name': name,
             'studentId': student_id,
             'branch': branch,
-            'embedding': embedding,
-            'photoUrl': photo_url
+            'embedding': templates[0],
+            'templates': templates,
+            'photoUrl': photo_url,
+            'photoHash': photo_hash,
+            'photoPending': photo_pending,
+            'updatedAt': datetime.utcnow(),
+            **mongo_utils.searchKeys(name, student_id)
         })
+    except DuplicateKeyError:
+        flash('Student ID already exists.', 'error')
+        return redirect(url_for('add_student'))
 
-        flash('Student added successfully', 'success')
-        return redirect(url_for('index'))
+    _queue_photo_upload(student_id, photo)
+    student_list_cache.clear()
+    flash(_photos_message('added', templates, photos), 'success')
+    return redirect(url_for('index'))
 
-    except CloudinaryError as e:
-        flash(f'Cloudinary error: {e}', 'error')
-        return redirect(url_for('add_student'))
+
+# Background bulk-enrollment jobs, keyed by job id. Each job runs a process
+# pool that loads the model in every worker, so only one runs at a time.
+bulk_jobs = {}
+bulk_jobs_lock = threading.Lock()
+BULK_JOB_TTL = 3600   # seconds a finished job's status stays available
+
+
+def _running_bulk_job():
+    """Evicts finished jobs older than BULK_JOB_TTL and returns the running job's id, or None. Caller holds bulk_jobs_lock."""
+    now = time.time()
+    running = None
+    for job_id, job in list(bulk_jobs.items()):
+        with job.lock:
+            finished, finished_at = job.finished, job.finished_at
+        if not finished:
+            running = job_id
+        elif finished_at is not None and now - finished_at > BULK_JOB_TTL:
+            del bulk_jobs[job_id]
+    return running
+
+
+@app.route('/bulk-enroll', methods=['POST'])
+def bulk_enroll():
+    """
+    Upload a zip with manifest.csv (name, student_id, branch, photo) and the photos.
+    Enrollment runs in the background; poll /bulk-enroll/<job_id> for progress.
+    """
+    archive = request.files.get('archive')
+    if archive is None or archive.filename == '':
+        return jsonify({'success': False, 'error': 'No archive uploaded'}), 400
+
+    with bulk_jobs_lock:
+        running = _running_bulk_job()
+    if running is not None:
+        return jsonify({'success': False, 'error': 'A bulk enrollment is already running', 'job_id': running}), 409
+
+    # the request's upload stream is gone once we return, so keep a copy on disk
+    tmp = tempfile.NamedTemporaryFile(suffix='.zip', delete=False)
+    archive.save(tmp)
+    tmp.close()
+
+    try:
+        rows, read_photos = enroll_utils.loadZipManifest(tmp.name)
+    except (zipfile.BadZipFile, KeyError, ValueError) as e:
+        os.remove(tmp.name)
+        return jsonify({'success': False, 'error': f'Invalid archive: {e}'}), 400
+
+    job_id = uuid.uuid4().hex
+    job = enroll_utils.BulkEnrollment(rows, read_photos, uploader=enroll_utils.mediaUploader(media_uploader))
+    with bulk_jobs_lock:
+        # another upload may have started a job while this archive was being read
+        running = _running_bulk_job()
+        if running is None:
+            bulk_jobs[job_id] = job
+    if running is not None:
+        os.remove(tmp.name)
+        return jsonify({'success': False, 'error': 'A bulk enrollment is already running', 'job_id': running}), 409
+
+    def run():
+        try:
+            job.run()
+        except Exception as e:
+            logger.exception("Bulk enrollment %s failed: %s", job_id, e)
+            with job.lock:
+                job.errors.append({'row': None, 'student_id': None, 'error': str(e)})
+                job.finished = True
+                job.finished_at = time.time()
+        finally:
+            student_list_cache.clear()
+            os.remove(tmp.name)
+
+    threading.Thread(target=run, name=f'bulk-enroll-{job_id[:8]}', daemon=True).start()
+    return jsonify({'success': True, 'job_id': job_id, 'total': len(rows)}), 202
+
+
+@app.route('/bulk-enroll/<job_id>')
+def bulk_enroll_status(job_id):
+    with bulk_jobs_lock:
+        _running_bulk_job()
+        job = bulk_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify(dict(job.stats(), success=True))
 
 
 @app.route('/edit-student/<student_id>', methods=['GET', 'POST'])
@@ -101,41 +360,61 @@ def edit_student(student_id):
 
     name = request.form['name']
     branch = request.form['branch']
-    photo = request.files['photo']
-
-    try:
-        upload_result = upload(photo)
-        photo_url = upload_result['secure_url']
-
-        photo.seek(0)
-        img = cv2.imdecode(np.frombuffer(photo.read(), np.uint8), cv2.IMREAD_COLOR)
-        embedding = model_utils.getEmbedding(img)
-
-        if embedding is None:
-            flash('Clear face not detected.', 'error')
-            return redirect(url_for('edit_student', student_id=student_id))
+    photos = [p for p in request.files.getlist('photo') if p.filename]
 
+    if not photos:
+        # the photo is optional when editing: keep the existing templates
         mongo_utils.students_collection.update_one(
             {'studentId': student_id},
             {'$set': {
                 'name': name,
                 'branch': branch,
-                'embedding': embedding,
-                'photoUrl': photo_url
+                'updatedAt': datetime.utcnow(),
+                **mongo_utils.searchKeys(name, student_id)
             }}
         )
-
+        student_list_cache.clear()
         flash('Student updated successfully', 'success')
         return redirect(url_for('index'))
 
-    except CloudinaryError as e:
-        flash(f'Cloudinary error: {e}', 'error')
+    templates, photo = _embed_photos(photos)
+
+    if not templates:
+        flash('Clear face not detected.', 'error')
         return redirect(url_for('edit_student', student_id=student_id))
 
+    photo_hash, photo_url, photo_pending = _photo_url(photo, student.get('photoUrl') if student else None)
+
+    # new enrollment photos replace the old templates and anything learned from them
+    result = mongo_utils.students_collection.update_one(
+        {'studentId': student_id},
+        {
+            '$set': {
+                'name': name,
+                'branch': branch,
+                'embedding': templates[0],
+                'templates': templates,
+                'photoUrl': photo_url,
+                'photoHash': photo_hash,
+                'photoPending': photo_pending,
+                'updatedAt': datetime.utcnow(),
+                **mongo_utils.searchKeys(name, student_id)
+            },
+            '$unset': {'liveTemplates': ''}
+        }
+    )
+
+    if result.matched_count:
+        _queue_photo_upload(student_id, photo)
+    student_list_cache.clear()
+    flash(_photos_message('updated', templates, photos), 'success')
+    return redirect(url_for('index'))
+
 
 @app.route('/delete-student/<student_id>')
 def delete_student(student_id):
     mongo_utils.deleteStudent(student_id)
+    student_list_cache.clear()
     flash('Student removed successfully', 'success')
     return redirect(url_for('index'))
 
@@ -146,79 +425,14 @@ def delete_student(student_id):
 @app.route('/chat', methods=['POST'])
 def chat():
     data = request.get_json()
-    user_query = data.get('query', '').lower()
-    
-    try:
-        # Fetch Data from MongoDB
-        detections = list(mongo_utils.detections_collection.find({}, {'_id': 0}))
-        
-        if not detections:
-            return jsonify({'success': True, 'answer': "I don't see any detection records in the system yet."})
-            
-        df = pd.DataFrame(detections)
-        df['timestamp'] = df['timestamp'].astype(str)
-        
-        # --- SMART LOGIC: CHECK FOR NAMES FIRST ---
-        
-        # 1. Check if any student name is in the query
-        # This handles: "Govind detected timings", "Logs for Jitho", "Show me Govind"
-        all_names = df['name'].unique()
-        found_name = None
-        
-        for name in all_names:
-            # Check if the name appears in the user's question
-            if name.lower() in user_query:
-                found_name = name
-                break
-        
-        if found_name:
-            # If name found, get their specific logs
-            student_logs = df[df['name'] == found_name]
-            times = student_logs['timestamp'].tolist()
-            count = len(times)
-            
-            # Formatting the response nicely
-            if count > 0:
-                # Show only last 5 if there are too many
-                if count > 5:
-                    recent_times = times[-5:]
-                    time_list_html = "<br>• " + "<br>• ".join(recent_times)
-                    response_text = f"Found {count} records for <b>{found_name}</b>.<br>Most recent detections:{time_list_html}"
-                else:
-                    time_list_html = "<br>• " + "<br>• ".join(times)
-                    response_text = f"<b>{found_name}</b> was detected at:{time_list_html}"
-            else:
-                response_text = f"I found <b>{found_name}</b> in the database, but there are no detection logs yet."
-                
-            return jsonify({'success': True, 'answer': response_text})
-
-        # 2. General Questions ("Who", "List", "Show")
-        elif any(k in user_query for k in ['who', 'list', 'show', 'all']):
-            if 'cse' in user_query:
-                result = df[df['branch'].str.upper() == 'CSE']
-                branch_name = "CSE"
-            elif 'cs' in user_query:
-                 result = df[df['branch'].str.upper() == 'CS']
-                 branch_name = "CS"
-            else:
-                result = df
-                branch_name = "all"
-                
-            names = result['name'].unique()
-            names_str = ", ".join(names)
-            return jsonify({'success': True, 'answer': f"Students detected ({branch_name}): {names_str}."})
-
-        # 3. Count Questions
-        elif any(k in user_query for k in ['count', 'how many', 'total']):
-            count = df['studentId'].nunique()
-            return jsonify({'success': True, 'answer': f"There are {count} unique students detected in the logs."})
-
-        # Fallback
-        else:
-            return jsonify({'success': True, 'answer': "I didn't understand that. <br>Try typing just a name like <b>'Govind'</b>, or ask <b>'Who was seen?'</b>."})
+    user_query = data.get('query', '')
 
+    try:
+        with metrics_utils.timed('chat'):
+            answer = chat_engine.answer(user_query)
+        return jsonify({'success': True, 'answer': answer})
     except Exception as e:
-        print(f"Chat Error: {e}")
+        logger.exception("Chat Error: %s", e)
         return jsonify({'success': False, 'error': str(e)})
 
 
@@ -237,13 +451,12 @@ def send_email():
     final_photo_url = data.get("photoUrl")
 
     if live_image:
-        try:
-            print("Uploading live capture to Cloudinary...")
-            upload_result = upload(live_image)
-            final_photo_url = upload_result['secure_url']
-            print(f"Live image uploaded: {final_photo_url}")
-        except Exception as e:
-            print(f"Cloudinary upload failed: {e}")
+        # The alert dispatcher uploads its capture itself and sends photoUrl, so
+        # this is only for other callers. The upload isn't waited for: an already
+        # uploaded capture (e.g. a retry) or a public cache URL beats the enrolled photo.
+        digest = media_uploader.store(live_image.read())
+        media_uploader.submit(digest)
+        final_photo_url = media_uploader.cache.remoteUrl(digest) or media_utils.pendingUrl(digest) or final_photo_url
 
     payload = {
         "service_id": os.getenv("EMAILJS_SERVICE_ID"),
@@ -261,38 +474,139 @@ def send_email():
     }
 
     try:
-        response = requests.post(
-            "https://api.emailjs.com/api/v1.0/email/send",
-            headers={"Content-Type": "application/json"},
-            json=payload,
-            timeout=10 
-        )
+        with metrics_utils.timed('email_send'):
+            response = requests.post(
+                "https://api.emailjs.com/api/v1.0/email/send",
+                headers={"Content-Type": "application/json"},
+                json=payload,
+                timeout=EMAILJS_TIMEOUT
+            )
         return jsonify({"success": response.status_code == 200})
     except requests.RequestException as e:
         return jsonify({'success': False, 'error': str(e)})
 
 
+REPORT_CHUNK_ROWS = 500  # rows per chunk written to the response
+
+
+def _parse_report_date(value):
+    if not value:
+        return None
+    # dates are local to the server; .astimezone() makes them aware so Mongo compares in UTC
+    return datetime.strptime(value, '%Y-%m-%d').astimezone()
+
+
 @app.route('/download-report')
 def download_report():
-    detections = list(mongo_utils.detections_collection.find({}, {'_id': 0}))
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Name', 'Student ID', 'Branch', 'Timestamp', 'Photo URL'])
-
-    for d in detections:
-        writer.writerow([
-            d['name'], d['studentId'], d['branch'], d['timestamp'], d['photoUrl']
-        ])
-
-    output.seek(0)
-    return send_file(
-        BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name='detection_report.csv'
+    """
+    Streams the detection report straight from a Mongo cursor.
+    Optional query params: start, end (YYYY-MM-DD, inclusive), branch, student_id, gzip=1.
+    """
+    try:
+        start = _parse_report_date(request.args.get('start'))
+        end = _parse_report_date(request.args.get('end'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+    if end is not None:
+        end += timedelta(days=1)
+
+    query = mongo_utils.buildDetectionQuery(
+        start=start,
+        end=end,
+        branch=request.args.get('branch'),
+        student_id=request.args.get('student_id')
+    )
+    use_gzip = request.args.get('gzip') in ('1', 'true', 'yes')
+
+    def generate_rows():
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Name', 'Student ID', 'Branch', 'Timestamp', 'Photo URL'])
+
+        for n, d in enumerate(mongo_utils.iterDetections(query), start=1):
+            writer.writerow([d.get(field) for field in mongo_utils.DETECTION_REPORT_FIELDS])
+            if n % REPORT_CHUNK_ROWS == 0:
+                yield output.getvalue().encode('utf-8')
+                output.seek(0)
+                output.truncate(0)
+        yield output.getvalue().encode('utf-8')
+
+    def generate_gzip():
+        compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+        for chunk in generate_rows():
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    if use_gzip:
+        body, mimetype, filename = generate_gzip(), 'application/gzip', 'detection_report.csv.gz'
+    else:
+        body, mimetype, filename = generate_rows(), 'text/csv', 'detection_report.csv'
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
 
+def _startup_tasks():
+    """Database work that doesn't need to hold up the server's first request."""
+    try:
+        chat_utils.ensureIndexes()
+    except Exception as e:
+        logger.warning("Could not create indexes: %s", e)
+    try:
+        # uploads interrupted by a restart pick up where they stopped
+        media_utils.resumePending(media_uploader, mongo_utils.students_collection, _photo_uploaded)
+    except Exception as e:
+        logger.warning("Could not resume pending photo uploads: %s", e)
+
+
+STUDENT_INDEX_RETRY = 5        # seconds before retrying the unique studentId index, doubled on every failure
+STUDENT_INDEX_RETRY_MAX = 300
+
+
+def _ensure_student_index():
+    """
+    Create the unique studentId index enrollment relies on, retrying until it
+    exists. Until then add_student checks for a duplicate before each insert.
+    """
+    delay = STUDENT_INDEX_RETRY
+    while True:
+        try:
+            mongo_utils.ensureStudentIndexes()
+            logger.info("Unique studentId index in place")
+            return
+        except OperationFailure as e:
+            logger.error("Could not create the unique studentId index (duplicate studentIds?), retrying in %ss: %s", delay, e)
+        except PyMongoError as e:
+            logger.warning("Could not create the unique studentId index, retrying in %ss: %s", delay, e)
+        time.sleep(delay)
+        delay = min(delay * 2, STUDENT_INDEX_RETRY_MAX)
+
+
+def _start_services():
+    """Startup work for a process that serves the app; none of it blocks on the database."""
+    threading.Thread(target=_ensure_student_index, name='student-index', daemon=True).start()
+
+    # Warm up DeepFace in the background; enrollment requests wait for it
+    # instead of racing each other through DeepFace's lazy init. A dashboard-only
+    # deployment can set MODEL_WARMUP=0 and never load TensorFlow at all.
+    if os.getenv('MODEL_WARMUP', '1') == '1':
+        model_utils.loadModelInBackground()
+
+    threading.Thread(target=_startup_tasks, name='startup-tasks', daemon=True).start()
+
+
+# Bulk enrollment's embedding workers are spawned processes, and under
+# `python app.py` each one re-imports this module as __mp_main__. They only
+# need enroll_utils._embed_photos, so they skip the app's startup work.
+if __name__ != '__mp_main__':
+    _start_services()
+
+
 if __name__ == '__main__':
-    print("Starting Flask server...")
+    logger.info("Starting Flask server...")
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,132 @@
+import csv
+import logging
+import os
+import threading
+
+ATTENDANCE_FILE = 'attendance.csv'
+EVENT_LOG_FILE = 'attendance.events.csv'
+MATERIALIZE_INTERVAL = 60   # seconds between background rewrites of attendance.csv
+ROTATE_EVENTS = 5000        # materialize early once the event log grows this long
+
+logger = logging.getLogger(__name__)
+
+
+class AttendanceLog:
+    """
+    Append-only attendance store.
+
+    Every detection is appended as one line to an event log and applied to an
+    in-memory index keyed by (studentId, date), so the write path costs the
+    same no matter how big attendance.csv gets. The index is materialized to
+    attendance.csv in the existing row format (Name, ID, Branch, Date,
+    Time1, Time2...) on demand, periodically, and when the event log is
+    rotated. Replaying the event log is idempotent, so a crash between
+    rewriting the CSV and truncating the log loses nothing.
+    """
+
+    def __init__(self, filename=ATTENDANCE_FILE, event_log=EVENT_LOG_FILE,
+                 materialize_interval=MATERIALIZE_INTERVAL, rotate_events=ROTATE_EVENTS):
+        self.filename = filename
+        self.event_log = event_log
+        self.materialize_interval = materialize_interval
+        self.rotate_events = rotate_events
+        self.lock = threading.Lock()
+        self.rows = []          # rows in attendance.csv order
+        self.index = {}         # (studentId, date) -> position in rows
+        self.times = {}         # (studentId, date) -> set of logged times
+        self.pending = 0        # events not yet materialized
+        self._log = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._load()
+
+    # ---------- loading ----------
+
+    def _load(self):
+        if os.path.isfile(self.filename):
+            with open(self.filename, 'r', newline='') as f:
+                for row in csv.reader(f):
+                    self.rows.append(row)
+                    # Row format: Name, ID, Branch, Date, Time1, Time2...
+                    if len(row) >= 4:
+                        key = (row[1], row[3])
+                        self.index.setdefault(key, len(self.rows) - 1)
+                        self.times.setdefault(key, set()).update(row[4:])
+
+        if os.path.isfile(self.event_log):
+            with open(self.event_log, 'r', newline='') as f:
+                for event in csv.reader(f):
+                    if len(event) == 5:
+                        self._apply(*event)
+                        self.pending += 1
+
+        self._log = open(self.event_log, 'a', newline='')
+        self._writer = csv.writer(self._log)
+
+    def _apply(self, name, student_id, branch, date, time_str):
+        key = (student_id, date)
+        pos = self.index.get(key)
+        if pos is None:
+            self.index[key] = len(self.rows)
+            self.rows.append([name, student_id, branch, date, time_str])
+            self.times[key] = {time_str}
+        elif time_str not in self.times[key]:
+            self.rows[pos].append(time_str)
+            self.times[key].add(time_str)
+
+    # ---------- write path ----------
+
+    def record(self, name, student_id, branch, date, time_str):
+        """Append one detection. Constant cost: one log line plus a dict update."""
+        with self.lock:
+            key = (student_id, date)
+            if time_str in self.times.get(key, ()):
+                return
+            self._writer.writerow([name, student_id, branch, date, time_str])
+            self._log.flush()
+            self._apply(name, student_id, branch, date, time_str)
+            self.pending += 1
+            rotate = self.pending >= self.rotate_events
+        if rotate:
+            self.materialize()
+
+    def getRow(self, student_id, date):
+        with self.lock:
+            pos = self.index.get((student_id, date))
+            return list(self.rows[pos]) if pos is not None else None
+
+    # ---------- materialization ----------
+
+    def materialize(self):
+        """Rewrite attendance.csv from the index, then truncate the event log."""
+        with self.lock:
+            if self.pending == 0 and os.path.isfile(self.filename):
+                return
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w', newline='') as f:
+                csv.writer(f).writerows(self.rows)
+            os.replace(tmp, self.filename)
+
+            self._log.close()
+            self._log = open(self.event_log, 'w', newline='')
+            self._writer = csv.writer(self._log)
+            self.pending = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='attendance-materialize', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.materialize_interval):
+            try:
+                self.materialize()
+            except OSError as e:
+                logger.error('Error materializing %s: %s', self.filename, e)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.materialize()
+        with self.lock:
+            self._log.close()
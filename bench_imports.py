@@ -0,0 +1,88 @@
+"""
+Measure how long each module takes to import, and what the time goes to.
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+so nothing is shared between measurements. Reported per module: wall time of
+the whole interpreter run, the module's cumulative import time, and the
+packages (project modules included) with the largest self time. Modules over
+--budget seconds are flagged.
+
+The app is imported with MODEL_WARMUP=0, as a dashboard-only deployment runs
+it; it still needs the .env file and MONGODB_URI.
+
+Usage: python bench_imports.py [--modules app main model_utils] [--repeat 3] [--top 5] [--budget 1.0]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+DEFAULT_MODULES = [
+    'app', 'main', 'model_utils', 'gallery_utils', 'mongo_utils', 'chat_utils',
+    'media_utils', 'enroll_utils', 'camera_utils', 'alert_utils', 'metrics_utils'
+]
+
+
+def parse_importtime(stderr):
+    """Returns ({top-level package: summed self seconds}, {module: cumulative seconds})."""
+    self_by_package = defaultdict(float)
+    cumulative = {}
+    for line in stderr.splitlines():
+        # "import time:  <self us> | <cumulative us> | <indent><module>"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        self_by_package[name.split('.')[0]] += int(self_us) / 1e6
+        cumulative.setdefault(name, int(cumulative_us) / 1e6)
+    return self_by_package, cumulative
+
+
+def measure(module, env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f'exit {proc.returncode}'
+        return None, error
+    self_by_package, cumulative = parse_importtime(proc.stderr)
+    return {'wall': wall, 'import': cumulative.get(module, 0.0), 'packages': self_by_package}, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per module; the fastest is reported')
+    parser.add_argument('--top', type=int, default=5, help='heaviest packages listed per module')
+    parser.add_argument('--budget', type=float, default=1.0, help='flag modules whose import takes longer (seconds)')
+    args = parser.parse_args()
+
+    env = dict(os.environ, MODEL_WARMUP='0')
+
+    print(f"{'module':>14} {'wall s':>8} {'import s':>9}  heaviest packages (self s)")
+    for module in args.modules:
+        best, error = None, None
+        for _ in range(args.repeat):
+            result, error = measure(module, env)
+            if result is None:
+                break
+            if best is None or result['import'] < best['import']:
+                best = result
+        if best is None:
+            print(f'{module:>14} {"-":>8} {"-":>9}  failed: {error}')
+            continue
+
+        heaviest = sorted(best['packages'].items(), key=lambda item: item[1], reverse=True)[:args.top]
+        packages = ', '.join(f'{name} {seconds:.3f}' for name, seconds in heaviest)
+        flag = '  OVER BUDGET' if best['import'] > args.budget else ''
+        print(f"{module:>14} {best['wall']:>8.3f} {best['import']:>9.3f}  {packages}{flag}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark the gallery matcher backends on synthetic Facenet-sized embeddings.
+
+Each student gets --templates templates. The raw backends index one
+centroid per student; the tmpl-* rows run matcher_utils.TemplateMatcher over
+each backend, which is what recognition (gallery_utils) searches with.
+Reports queries/sec and recall@1 against exact search over every template.
+
+Usage: python bench_matcher.py [--sizes 1000 10000 100000] [--queries 500] [--templates 3] [--n-probe 8]
+"""
+import argparse
+import functools
+import time
+import numpy as np
+
+import matcher_utils
+
+EMBEDDING_DIM = 128
+
+
+def make_gallery(n_students, n_queries, n_templates=1, seed=0):
+    """
+    Templates of every student (grouped per student, `offsets` as in
+    TemplateMatcher) plus noisy 'live' captures of randomly chosen students.
+    """
+    rng = np.random.default_rng(seed)
+    # Facenet embeddings are unnormalised with per-dimension spread of roughly 1-2
+    faces = rng.normal(0, 1.5, size=(n_students, EMBEDDING_DIM)).astype(np.float32)
+    templates = np.repeat(faces, n_templates, axis=0)
+    if n_templates > 1:
+        # enrollment photos of one student differ less than live captures do
+        templates += rng.normal(0, 0.4, size=templates.shape).astype(np.float32)
+    offsets = np.arange(n_students + 1, dtype=np.int64) * n_templates
+    picked = rng.integers(0, n_students, size=n_queries)
+    queries = faces[picked] + rng.normal(0, 0.6, size=(n_queries, EMBEDDING_DIM)).astype(np.float32)
+    return templates, offsets, queries
+
+
+def run_queries(matcher, queries, batch_size):
+    """Search in frame-sized batches; returns (top-1 rows, queries/sec)."""
+    top1 = np.empty(len(queries), dtype=int)
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        rows, _ = matcher.search(queries[i:i + batch_size], 1)
+        top1[i:i + batch_size] = rows[:, 0]
+    elapsed = time.perf_counter() - start
+    return top1, len(queries) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=8, help='faces per frame')
+    parser.add_argument('--templates', type=int, default=3, help='templates per student')
+    parser.add_argument('--n-probe', type=int, default=matcher_utils.IVF_N_PROBE)
+    args = parser.parse_args()
+
+    print(f"{'students':>9} {'backend':>10} {'build s':>8} {'qps':>10} {'recall@1':>9}")
+    for size in args.sizes:
+        templates, offsets, queries = make_gallery(size, args.queries, args.templates)
+        centroids = matcher_utils.templateCentroids(templates, offsets)
+
+        # ground truth: the student owning the closest template
+        truth_rows, _ = matcher_utils.ExactMatcher(templates).search(queries, 1)
+        truth = np.searchsorted(offsets, truth_rows[:, 0], side='right') - 1
+
+        candidates = []
+        for name, cls in matcher_utils.MATCHERS.items():
+            backend = functools.partial(cls, n_probe=args.n_probe) if name == 'ivf' else cls
+            candidates.append((name, lambda backend=backend: backend(centroids)))
+            candidates.append((f'tmpl-{name}', lambda backend=backend: matcher_utils.TemplateMatcher(
+                templates, offsets, backend=backend)))
+
+        for name, build in candidates:
+            start = time.perf_counter()
+            matcher = build()
+            build_time = time.perf_counter() - start
+
+            top1, qps = run_queries(matcher, queries, args.batch_size)
+            recall = float(np.mean(top1 == truth))
+            print(f'{size:>9} {name:>10} {build_time:>8.2f} {qps:>10.0f} {recall:>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark gallery cold start and matching accuracy: Mongo documents vs snapshots.
+
+"mongo" decodes every student as BSON (what the driver does on a full
+gallery load, network excluded) and builds the float32 matrix. The snapshot
+rows memory-map the float32/float16/int8 files with the page cache dropped
+first. Accuracy compares top-1 results and match/no-match decisions at the
+live DISTANCE_THRESHOLD against float32.
+
+Usage: python bench_snapshot.py [--sizes 10000 100000] [--queries 1000] [--threshold 10]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import bson
+import numpy as np
+
+import matcher_utils
+import snapshot_utils
+from bench_matcher import make_gallery
+
+DISTANCE_THRESHOLD = 10  # mongo_utils.DISTANCE_THRESHOLD, without connecting to Mongo
+
+
+def make_docs(gallery):
+    return [
+        {
+            '_id': bson.ObjectId(),
+            'studentId': f'S{i:06d}',
+            'name': f'Student {i}',
+            'branch': 'CSE',
+            'photoUrl': f'https://res.cloudinary.com/demo/image/upload/{i}.jpg',
+            'embedding': row.tolist()
+        }
+        for i, row in enumerate(gallery)
+    ]
+
+
+def drop_page_cache(path):
+    for name in os.listdir(path):
+        fd = os.open(os.path.join(path, name), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def mongo_cold_start(wire):
+    start = time.perf_counter()
+    docs = bson.decode_all(wire)
+    embeddings = np.asarray([d['embedding'] for d in docs], dtype=np.float32)
+    matcher_utils.ExactMatcher(embeddings)
+    return embeddings, time.perf_counter() - start
+
+
+def snapshot_cold_start(path):
+    drop_page_cache(path)
+    start = time.perf_counter()
+    snapshot = snapshot_utils.loadSnapshot(path)
+    matcher_utils.ExactMatcher(snapshot.embeddings)
+    return snapshot.embeddings, time.perf_counter() - start
+
+
+def top1(embeddings, queries):
+    rows, dists = matcher_utils.ExactMatcher(embeddings).search(queries, 1)
+    return rows[:, 0], dists[:, 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--threshold', type=float, default=DISTANCE_THRESHOLD)
+    args = parser.parse_args()
+
+    print(f"{'students':>9} {'source':>8} {'MB':>7} {'cold s':>8} {'top1 agree':>11} "
+          f"{'decision agree':>15} {'max |d err|':>12}")
+    for size in args.sizes:
+        gallery, queries = make_gallery(size, args.queries)
+        docs = make_docs(gallery)
+        wire = b''.join(bson.encode(d) for d in docs)
+
+        embeddings, elapsed = mongo_cold_start(wire)
+        ref_rows, ref_dists = top1(embeddings, queries)
+        print(f'{size:>9} {"mongo":>8} {len(wire) / 1e6:>7.1f} {elapsed:>8.3f} {"-":>11} {"-":>15} {"-":>12}')
+
+        for dtype in snapshot_utils.SNAPSHOT_DTYPES:
+            path = tempfile.mkdtemp(prefix='gallery-snapshot-')
+            try:
+                manifest = snapshot_utils.writeSnapshot(docs, path, dtype)
+                size_mb = sum(os.path.getsize(os.path.join(path, n)) for n in manifest['files'].values()) / 1e6
+                embeddings, elapsed = snapshot_cold_start(path)
+                rows, dists = top1(embeddings, queries)
+            finally:
+                shutil.rmtree(path)
+            agree = np.mean(rows == ref_rows)
+            decisions = np.mean((dists <= args.threshold) == (ref_dists <= args.threshold))
+            err = np.max(np.abs(dists - ref_dists))
+            print(f'{size:>9} {dtype:>8} {size_mb:>7.1f} {elapsed:>8.3f} {agree:>11.4f} {decisions:>15.4f} {err:>12.4f}')
+
+
+if __name__ == '__main__':
+    main()
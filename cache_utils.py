@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 300        # seconds
+DEFAULT_MAX_ENTRIES = 128
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    `clear()` is the invalidation hook for writes.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0            # bumped by clear()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, generation=None):
+        """Store `value`; skipped when `generation` is given and a clear() happened since it was read."""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def getOrCompute(self, key, compute):
+        with self.lock:
+            generation = self.generation
+        value = self.get(key)
+        if value is None:
+            # a write that clears the cache while this computes leaves the
+            # (possibly stale) result uncached
+            value = compute()
+            self.set(key, value, generation)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
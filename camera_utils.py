@@ -0,0 +1,231 @@
+import logging
+import re
+import threading
+import time
+import cv2
+
+import pipeline_utils
+import motion_utils
+import tracking_utils
+import mongo_utils
+import metrics_utils
+import schedule_utils
+
+RECONNECT_DELAY = 1       # seconds before the first reconnect attempt
+RECONNECT_DELAY_MAX = 30  # reconnect backoff cap
+
+logger = logging.getLogger(__name__)
+
+frames_captured = metrics_utils.counter('campuseye_camera_frames', 'Frames read from each camera', ['camera'])
+camera_fps = metrics_utils.gauge('campuseye_camera_fps', 'Measured capture rate of each camera', ['camera'])
+camera_reconnects = metrics_utils.counter('campuseye_camera_reconnects', 'Camera reconnects after a lost stream', ['camera'])
+
+
+_URL_SCHEME = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*://')
+
+
+def parseSource(source):
+    """'0' -> device index 0; anything else (RTSP URL, video file) is passed to OpenCV as-is."""
+    source = str(source).strip()
+    return int(source) if source.isdigit() else source
+
+
+def isVideoFile(source):
+    """
+    True for a parsed source that is neither a device index nor a URL
+    (rtsp://, http://, ...). Decided from the source alone, so a mistyped path
+    still counts as a file and stops when it can't be opened.
+    """
+    return isinstance(source, str) and not _URL_SCHEME.match(source)
+
+
+class CameraSource:
+    """
+    One capture thread per camera. Reads frames as fast as the source
+    delivers them, keeps the latest one for display, and hands sampled
+    frames to the shared recognition pipeline without ever blocking on it.
+    Live sources reconnect with backoff; video files stop at their end.
+    Video files are sampled on their own timeline, so replaying one faster
+    than realtime sends the same frames to recognition.
+    """
+
+    def __init__(self, name, source, pipeline, should_process, sampler=None, face_check=False, realtime=True):
+        self.name = name
+        self.source = parseSource(source)
+        self.is_file = isVideoFile(self.source)
+        self.pipeline = pipeline
+        self.should_process = should_process   # callable: is detection enabled right now?
+        self.sampler = sampler or schedule_utils.AdaptiveSampler(backlog=pipeline.depth)
+        self.realtime = realtime               # pace video files at their native FPS
+
+        # per-camera recognition state
+        self.motion_gate = motion_utils.MotionGate(face_check=face_check)
+        self.tracker = tracking_utils.FaceTracker(mongo_utils.DISTANCE_THRESHOLD)
+        self.latency = pipeline_utils.StageTimer()   # capture -> recognition finished
+
+        self.lock = threading.Lock()
+        self.latest_frame = None
+        self.frames = 0
+        self.submitted = 0
+        self.read_errors = 0
+        self.reconnects = 0
+        self.clock = 0.0     # monotonic time, or position in the file for video files
+        self.connected = False
+        self.finished = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'camera-{self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def markFaces(self, num_faces):
+        """Feed back how many faces recognition found in one of this camera's frames."""
+        self.motion_gate.markFaces(num_faces)
+        self.sampler.markFaces(num_faces, now=self.clock)
+
+    def getFrame(self):
+        with self.lock:
+            return self.latest_frame
+
+    def stats(self):
+        with self.lock:
+            return {
+                'source': str(self.source),
+                'connected': self.connected,
+                'finished': self.finished,
+                'fps': self.sampler.stats()['fps'],
+                'frames': self.frames,
+                'submitted': self.submitted,
+                'read_errors': self.read_errors,
+                'reconnects': self.reconnects,
+                'latency': self.latency.stats(),
+                'sampler': self.sampler.stats(),
+                'motion_gate': self.motion_gate.stats(),
+                'tracker': self.tracker.stats()
+            }
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        return cap
+
+    def _run(self):
+        delay = RECONNECT_DELAY
+        while not self._stop.is_set():
+            cap = self._open()
+            if cap is None:
+                if self.is_file:
+                    logger.error('[%s] Could not open video file %s', self.name, self.source)
+                    break
+                logger.warning('[%s] Error opening camera %s, retrying in %ss', self.name, self.source, delay)
+                self._stop.wait(delay)
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+                continue
+
+            with self.lock:
+                if self.connected is False and self.frames:
+                    self.reconnects += 1
+                    camera_reconnects.inc(camera=self.name)
+                self.connected = True
+            read = self._capture(cap)
+            cap.release()
+            with self.lock:
+                self.connected = False
+            if self.is_file or self._stop.is_set():
+                break
+            # a camera that opens but fails its first read backs off like one
+            # that doesn't open; the delay only resets once frames came through
+            if read:
+                delay = RECONNECT_DELAY
+            self._stop.wait(delay)
+            delay = min(delay * 2, RECONNECT_DELAY_MAX)
+
+        with self.lock:
+            self.finished = True
+
+    def _capture(self, cap):
+        """Reads frames until the stream ends, fails or the source stops; returns how many were read."""
+        read = 0
+        frame_interval = 0.0
+        file_fps = cap.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+        if file_fps and self.realtime:
+            frame_interval = 1.0 / file_fps
+
+        while not self._stop.is_set():
+            started = time.monotonic()
+            ret, frame = cap.read()
+            if not ret:
+                if not self.is_file:
+                    logger.warning('[%s] Error in reading frame from camera, reconnecting', self.name)
+                    with self.lock:
+                        self.read_errors += 1
+                return read
+            read += 1
+
+            with self.lock:
+                self.latest_frame = frame
+                frame_counter = self.frames
+                self.frames += 1
+            frames_captured.inc(camera=self.name)
+
+            self.clock = frame_counter / file_fps if file_fps else time.monotonic()
+            if self.sampler.due(self.clock) and self.should_process() and self.motion_gate.check(frame, self.clock):
+                with self.lock:
+                    self.submitted += 1
+                if not self.pipeline.submit(frame.copy(), self, time.perf_counter()):
+                    logger.debug('[%s] Recognition busy, dropped oldest queued frame', self.name)
+
+            if frame_counter % 30 == 0:
+                camera_fps.set(self.sampler.fps, camera=self.name)
+
+            if frame_interval:
+                self._stop.wait(max(0.0, frame_interval - (time.monotonic() - started)))
+        return read
+
+
+class CameraSupervisor:
+    """Runs N CameraSources that share one recognition pipeline (and so one model instance)."""
+
+    def __init__(self, sources, handler, should_process, idle_interval=schedule_utils.IDLE_INTERVAL,
+                 active_interval=schedule_utils.ACTIVE_INTERVAL, num_workers=pipeline_utils.NUM_WORKERS,
+                 face_check=False, realtime=True):
+        self.pipeline = pipeline_utils.RecognitionPipeline(
+            handler,
+            num_workers=num_workers,
+            queue_size=max(pipeline_utils.QUEUE_SIZE, len(sources))
+        )
+        self.cameras = [
+            CameraSource(
+                f'cam{i}', source, self.pipeline, should_process,
+                sampler=schedule_utils.AdaptiveSampler(idle_interval, active_interval, backlog=self.pipeline.depth),
+                face_check=face_check, realtime=realtime
+            )
+            for i, source in enumerate(sources)
+        ]
+
+    def start(self):
+        self.pipeline.start()
+        for camera in self.cameras:
+            camera.start()
+
+    def stop(self):
+        for camera in self.cameras:
+            camera.stop()
+        self.pipeline.stop()
+
+    def allFinished(self):
+        return all(camera.finished for camera in self.cameras)
+
+    def stats(self):
+        return {
+            'pipeline': self.pipeline.stats(),
+            'cameras': {camera.name: camera.stats() for camera in self.cameras}
+        }
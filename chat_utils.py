@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import deque
+from pymongo import ASCENDING, DESCENDING
+
+import mongo_utils
+
+NAME_CACHE_TTL = 60     # seconds before the known-names matcher is rebuilt
+RECENT_LIMIT = 5        # detections listed for a single student
+
+# case-insensitive comparisons for branch names ('cse' == 'CSE')
+CASE_INSENSITIVE = {'locale': 'en', 'strength': 2}
+
+
+def ensureIndexes(collection=None):
+    collection = collection if collection is not None else mongo_utils.detections_collection
+    collection.create_index([('branch', ASCENDING)], collation=CASE_INSENSITIVE)
+    mongo_utils.ensureDetectionIndexes(collection)
+
+
+class NameMatcher:
+    """
+    Aho-Corasick automaton over lower-cased student names.
+    Finds every name occurring as a substring of a query in one pass
+    over the query, however many names are known.
+    """
+
+    def __init__(self, names):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for name in names:
+            self._add(name)
+        self._build()
+
+    def _add(self, name):
+        state = 0
+        for ch in name.lower():
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = nxt
+        self.output[state].append(name)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def findAll(self, text):
+        state = 0
+        found = []
+        for ch in text.lower():
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            found.extend(self.output[state])
+        return found
+
+    def find(self, text):
+        """Longest known name contained in `text`, or None."""
+        found = self.findAll(text)
+        return max(found, key=len) if found else None
+
+
+class ChatEngine:
+    """Answers /chat queries with indexed queries and aggregations instead of loading every detection."""
+
+    def __init__(self, collection=None):
+        self.collection = collection if collection is not None else mongo_utils.detections_collection
+        self.lock = threading.Lock()
+        self.matcher = None
+        self.matcher_built_at = 0.0
+
+    def _name_matcher(self):
+        with self.lock:
+            if self.matcher is None or time.monotonic() - self.matcher_built_at > NAME_CACHE_TTL:
+                # distinct() on the name index only touches one entry per student
+                self.matcher = NameMatcher(n for n in self.collection.distinct('name') if n)
+                self.matcher_built_at = time.monotonic()
+            return self.matcher
+
+    def recentDetections(self, name):
+        count = self.collection.count_documents({'name': name})
+        latest = self.collection.find({'name': name}, {'_id': 0, 'timestamp': 1}) \
+            .sort([('ts', DESCENDING), ('_id', DESCENDING)]).limit(RECENT_LIMIT)
+        times = [str(d.get('timestamp')) for d in latest][::-1]
+        return count, times
+
+    def detectedNames(self, branch=None):
+        """Distinct names in order of first detection, optionally for one branch."""
+        # Without a branch, sorting on the reverse of the (name, ts, _id) index
+        # lets $group/$first read one index entry per name. A branch filter
+        # goes through the branch index and groups that branch's detections.
+        pipeline = [{'$match': {'branch': branch}}] if branch else []
+        pipeline += [
+            {'$sort': {'name': DESCENDING, 'ts': ASCENDING}},
+            {'$group': {'_id': '$name', 'first_seen': {'$first': '$ts'}}},
+            {'$sort': {'first_seen': ASCENDING}}
+        ]
+        options = {'collation': CASE_INSENSITIVE} if branch else {}
+        return [d['_id'] for d in self.collection.aggregate(pipeline, **options) if d['_id']]
+
+    def uniqueStudentCount(self):
+        return len([s for s in self.collection.distinct('studentId') if s])
+
+    def answer(self, user_query):
+        user_query = user_query.lower()
+
+        if self.collection.estimated_document_count() == 0:
+            return "I don't see any detection records in the system yet."
+
+        # 1. Check if any student name is in the query
+        # This handles: "Govind detected timings", "Logs for Jitho", "Show me Govind"
+        found_name = self._name_matcher().find(user_query)
+
+        if found_name:
+            count, times = self.recentDetections(found_name)
+
+            # Formatting the response nicely
+            if count > 0:
+                time_list_html = "<br>• " + "<br>• ".join(times)
+                if count > RECENT_LIMIT:
+                    return f"Found {count} records for <b>{found_name}</b>.<br>Most recent detections:{time_list_html}"
+                return f"<b>{found_name}</b> was detected at:{time_list_html}"
+            return f"I found <b>{found_name}</b> in the database, but there are no detection logs yet."
+
+        # 2. General Questions ("Who", "List", "Show")
+        if any(k in user_query for k in ['who', 'list', 'show', 'all']):
+            if 'cse' in user_query:
+                branch_name = "CSE"
+            elif 'cs' in user_query:
+                branch_name = "CS"
+            else:
+                branch_name = None
+
+            names_str = ", ".join(self.detectedNames(branch_name))
+            return f"Students detected ({branch_name or 'all'}): {names_str}."
+
+        # 3. Count Questions
+        if any(k in user_query for k in ['count', 'how many', 'total']):
+            return f"There are {self.uniqueStudentCount()} unique students detected in the logs."
+
+        # Fallback
+        return "I didn't understand that. <br>Try typing just a name like <b>'Govind'</b>, or ask <b>'Who was seen?'</b>."
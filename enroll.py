@@ -0,0 +1,84 @@
+"""
+Bulk-enroll students from a CSV manifest or a zip archive.
+
+The manifest needs the columns name, student_id, branch, photo. For a CSV the
+photo column is a path relative to --photos-dir (default: the manifest's
+folder); for a zip it is a path inside the archive, next to manifest.csv.
+Several photos of one student can be listed separated by ';' and each one
+with a face becomes a matching template.
+Re-running the same manifest skips students that are already enrolled.
+
+Usage: python enroll.py students.zip [--workers 4] [--upload local --local-dir uploads] [--errors errors.csv]
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+import enroll_utils
+import media_utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('manifest', help='manifest .csv or .zip archive')
+    parser.add_argument('--photos-dir', help='folder the CSV photo paths are relative to')
+    parser.add_argument('--workers', type=int, default=enroll_utils.EMBED_WORKERS, help='embedding processes')
+    parser.add_argument('--upload-workers', type=int, default=enroll_utils.UPLOAD_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=enroll_utils.INSERT_BATCH_SIZE)
+    parser.add_argument('--upload', choices=list(media_utils.BACKENDS), help='media backend (default: MEDIA_BACKEND)')
+    parser.add_argument('--local-dir', help='destination for --upload local (default: MEDIA_LOCAL_DIR)')
+    parser.add_argument('--errors', help='write per-row errors to this CSV')
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+    if args.manifest.lower().endswith('.zip'):
+        rows, read_photos = enroll_utils.loadZipManifest(args.manifest)
+    else:
+        rows, read_photos = enroll_utils.loadDirectoryManifest(args.manifest, args.photos_dir)
+
+    backend = args.upload or os.getenv('MEDIA_BACKEND', media_utils.MEDIA_BACKEND)
+    options = {'directory': args.local_dir} if backend == 'local' and args.local_dir else {}
+    uploader = enroll_utils.mediaUploader(media_utils.MediaUploader(backend=media_utils.getBackend(backend, **options)))
+
+    start = time.time()
+    last_print = [0.0]
+
+    def progress(stats):
+        now = time.time()
+        if now - last_print[0] < 1 and not stats['finished']:
+            return
+        last_print[0] = now
+        rate = stats['processed'] / max(now - start, 1e-6)
+        print(f"\r{stats['processed']}/{stats['total']} processed, {stats['enrolled']} enrolled, "
+              f"{stats['skipped_existing']} already enrolled, {stats['failed']} failed ({rate:.1f}/s)",
+              end='', flush=True)
+
+    job = enroll_utils.BulkEnrollment(
+        rows, read_photos,
+        uploader=uploader,
+        embed_workers=args.workers,
+        upload_workers=args.upload_workers,
+        batch_size=args.batch_size,
+        progress=progress
+    )
+    stats = job.run()
+    print()
+
+    for err in stats['errors']:
+        print(f"row {err['row']} ({err['student_id']}): {err['error']}")
+    if args.errors and stats['errors']:
+        with open(args.errors, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['row', 'student_id', 'error'])
+            writer.writeheader()
+            writer.writerows(stats['errors'])
+        print(f"Errors written to {args.errors}")
+
+    sys.exit(1 if stats['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+import csv
+import io
+import os
+import threading
+import time
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from pymongo.errors import BulkWriteError, PyMongoError
+
+import mongo_utils
+
+EMBED_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+UPLOAD_WORKERS = 8
+INSERT_BATCH_SIZE = 200
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_COLUMNS = ['name', 'student_id', 'branch', 'photo']
+PHOTO_SEPARATOR = ';'      # a `photo` cell may list several photos of the same student
+MAX_PHOTOS = 10
+
+
+# --------------------------------------------------
+# Manifest sources
+# --------------------------------------------------
+
+def _read_manifest(f):
+    reader = csv.DictReader(io.TextIOWrapper(f, encoding='utf-8-sig', newline=''))
+    missing = [c for c in MANIFEST_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Manifest is missing column(s): {', '.join(missing)}")
+    rows = []
+    for n, row in enumerate(reader, start=2):  # row 1 is the header
+        row = {k: (v or '').strip() for k, v in row.items() if k}
+        row['row'] = n
+        rows.append(row)
+    return rows
+
+
+def photoPaths(row):
+    return [p.strip() for p in row['photo'].split(PHOTO_SEPARATOR) if p.strip()][:MAX_PHOTOS]
+
+
+def loadDirectoryManifest(manifest_path, photos_dir=None):
+    """CSV manifest whose `photo` column holds paths relative to `photos_dir`."""
+    photos_dir = photos_dir or os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'rb') as f:
+        rows = _read_manifest(f)
+
+    def read_photos(row):
+        photos = []
+        for path in photoPaths(row):
+            with open(os.path.join(photos_dir, path), 'rb') as f:
+                photos.append(f.read())
+        return photos
+    return rows, read_photos
+
+
+def loadZipManifest(zip_file):
+    """Zip archive with manifest.csv at its root and photos referenced by their path in the archive."""
+    archive = zipfile.ZipFile(zip_file)
+    with archive.open(MANIFEST_NAME) as f:
+        rows = _read_manifest(f)
+    lock = threading.Lock()  # ZipFile reads are not thread-safe
+
+    def read_photos(row):
+        with lock:
+            return [archive.read(path) for path in photoPaths(row)]
+    return rows, read_photos
+
+
+# --------------------------------------------------
+# Photo uploaders
+# --------------------------------------------------
+
+def mediaUploader(uploader=None):
+    """
+    Uploads photos through a media_utils.MediaUploader, so bulk enrollment
+    uses MEDIA_BACKEND, the content-addressed cache and the uploader's retries
+    like every other photo. Pass the app's shared uploader to reuse its pool.
+    """
+    import media_utils
+    uploader = uploader if uploader is not None else media_utils.MediaUploader()
+
+    def upload(photo_bytes, row):
+        return uploader.submit(uploader.store(photo_bytes)).result()
+    return upload
+
+
+# --------------------------------------------------
+# Embedding worker (runs in a separate process)
+# --------------------------------------------------
+
+def _init_worker():
+    import model_utils
+    model_utils.loadModel()
+
+
+def _embed_photos(photos):
+    """Returns (templates, index of the photo the first one came from, error)."""
+    import cv2
+    import numpy as np
+    import model_utils
+    templates = []
+    first = None
+    error = None
+    for i, photo_bytes in enumerate(photos):
+        img = cv2.imdecode(np.frombuffer(photo_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            error = 'Could not decode image'
+            continue
+        embedding = model_utils.getEmbedding(img)
+        if embedding is None:
+            error = 'Clear face not detected'
+            continue
+        templates.append(embedding)
+        first = i if first is None else first
+    if not templates:
+        return [], None, error
+    return templates, first, None
+
+
+# --------------------------------------------------
+# Bulk enrollment
+# --------------------------------------------------
+
+class BulkEnrollment:
+    """
+    Enrolls a manifest of students in one go.
+
+    Photos are decoded and embedded in a process pool, uploaded concurrently
+    once they have a face, and written with insert_many in batches. A row
+    may list several photos; each one with a face becomes a template and the
+    first is uploaded as the student's photo. Rows whose
+    studentId is already in the database are skipped, so re-running the same
+    manifest after a crash or partial failure resumes where it stopped.
+    """
+
+    def __init__(self, rows, read_photos, uploader=None, collection=None,
+                 embed_workers=EMBED_WORKERS, upload_workers=UPLOAD_WORKERS,
+                 batch_size=INSERT_BATCH_SIZE, progress=None):
+        self.rows = rows
+        self.read_photos = read_photos
+        self.uploader = uploader if uploader is not None else mediaUploader()
+        self.collection = collection if collection is not None else mongo_utils.students_collection
+        self.embed_workers = embed_workers
+        self.upload_workers = upload_workers
+        self.batch_size = batch_size
+        self.progress = progress   # called with stats() after every finished row
+
+        self.lock = threading.Lock()
+        self.total = len(rows)
+        self.processed = 0
+        self.enrolled = 0
+        self.skipped = 0
+        self.errors = []           # {'row', 'student_id', 'error'}
+        self.pending_docs = []
+        self.finished = False
+        self.finished_at = None    # time.time() when the run ended
+
+    def stats(self):
+        with self.lock:
+            return {
+                'total': self.total,
+                'processed': self.processed,
+                'enrolled': self.enrolled,
+                'skipped_existing': self.skipped,
+                'failed': len(self.errors),
+                'errors': list(self.errors),
+                'finished': self.finished
+            }
+
+    def _report(self):
+        if self.progress is not None:
+            self.progress(self.stats())
+
+    def _fail(self, row, error):
+        with self.lock:
+            self.processed += 1
+            self.errors.append({'row': row['row'], 'student_id': row.get('student_id'), 'error': str(error)})
+        self._report()
+
+    def _existing_ids(self, student_ids):
+        existing = set()
+        ids = list(student_ids)
+        for i in range(0, len(ids), 1000):
+            cursor = self.collection.find({'studentId': {'$in': ids[i:i + 1000]}}, {'studentId': 1, '_id': 0})
+            existing.update(doc['studentId'] for doc in cursor)
+        return existing
+
+    def _todo(self):
+        seen = set()
+        todo = []
+        for row in self.rows:
+            if not all(row.get(c) for c in MANIFEST_COLUMNS):
+                self._fail(row, 'Missing name, student_id, branch or photo')
+                continue
+            if row['student_id'] in seen:
+                self._fail(row, 'Duplicate student_id in manifest')
+                continue
+            seen.add(row['student_id'])
+            todo.append(row)
+
+        existing = self._existing_ids(seen)
+        remaining = []
+        for row in todo:
+            if row['student_id'] in existing:
+                with self.lock:
+                    self.processed += 1
+                    self.skipped += 1
+            else:
+                remaining.append(row)
+        self._report()
+        return remaining
+
+    def _flush(self, force=False):
+        with self.lock:
+            if not self.pending_docs or (not force and len(self.pending_docs) < self.batch_size):
+                return
+            docs, self.pending_docs = self.pending_docs, []
+
+        inserted = len(docs)
+        failed = []
+        try:
+            self.collection.insert_many([d for d, _ in docs], ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get('writeErrors', []):
+                failed.append((docs[err['index']][1], err.get('errmsg', 'write error')))
+            inserted -= len(failed)
+        except PyMongoError as e:
+            failed = [(row, f'Insert failed: {e}') for _, row in docs]
+            inserted = 0
+
+        with self.lock:
+            self.enrolled += inserted
+            self.processed += len(docs) - len(failed)
+        for row, error in failed:
+            self._fail(row, error)
+        self._report()
+
+    def _upload_and_queue(self, row, photo_bytes, templates):
+        try:
+            photo_url = self.uploader(photo_bytes, row)
+        except Exception as e:
+            self._fail(row, f'Upload failed: {e}')
+            return
+        doc = {
+            'name': row['name'],
+            'studentId': row['student_id'],
+            'branch': row['branch'],
+            'embedding': templates[0],
+            'templates': templates,
+            'photoUrl': photo_url,
+            'updatedAt': datetime.utcnow(),
+            **mongo_utils.searchKeys(row['name'], row['student_id'])
+        }
+        with self.lock:
+            self.pending_docs.append((doc, row))
+        self._flush()
+
+    def run(self):
+        rows = self._todo()
+        window = self.embed_workers * 4     # photos held in memory at once
+        ctx = multiprocessing.get_context('spawn')  # never fork a process that has TensorFlow loaded
+
+        with ProcessPoolExecutor(self.embed_workers, mp_context=ctx, initializer=_init_worker) as embed_pool, \
+                ThreadPoolExecutor(self.upload_workers) as upload_pool:
+            in_flight = {}
+            uploads = {}
+            rows_iter = iter(rows)
+            exhausted = False
+
+            while in_flight or not exhausted:
+                while not exhausted and len(in_flight) < window:
+                    row = next(rows_iter, None)
+                    if row is None:
+                        exhausted = True
+                        break
+                    try:
+                        photos = self.read_photos(row)
+                    except (OSError, KeyError) as e:
+                        self._fail(row, f'Photo not found: {e}')
+                        continue
+                    in_flight[embed_pool.submit(_embed_photos, photos)] = (row, photos)
+
+                if not in_flight:
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    row, photos = in_flight.pop(future)
+                    try:
+                        templates, first, error = future.result()
+                    except Exception as e:
+                        templates, error = [], e
+                    if not templates:
+                        self._fail(row, error)
+                        continue
+                    uploads[upload_pool.submit(self._upload_and_queue, row, photos[first], templates)] = row
+
+            wait(uploads)
+            for future, row in uploads.items():
+                if future.exception() is not None:
+                    self._fail(row, f'Enrollment failed: {future.exception()}')
+
+        self._flush(force=True)
+        with self.lock:
+            self.finished = True
+            self.finished_at = time.time()
+        self._report()
+        return self.stats()
@@ -0,0 +1,572 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from pymongo.errors import OperationFailure, PyMongoError
+
+import mongo_utils
+import matcher_utils
+import metrics_utils
+import snapshot_utils
+
+EMBEDDING_DIM = 128
+TOP_K = 10  # max matches returned per face (same as the old aggregation $limit)
+POLL_INTERVAL = 5  # seconds between polls when change streams are unavailable
+
+# Learning extra templates from live matches (off unless SELF_UPDATE_TEMPLATES=1)
+SELF_UPDATE = os.getenv('SELF_UPDATE_TEMPLATES') == '1'
+SELF_UPDATE_DISTANCE = float(os.getenv('SELF_UPDATE_DISTANCE', '6'))  # far stricter than DISTANCE_THRESHOLD
+SELF_UPDATE_MARGIN = 2.0       # the runner-up student must be at least this much further away
+SELF_UPDATE_MIN_NOVELTY = 1.0  # skip captures this close to a template we already have
+SELF_UPDATE_INTERVAL = 3600    # seconds between learned templates per student
+MAX_LIVE_TEMPLATES = 5         # oldest learned templates are dropped first; enrollment ones are kept
+
+logger = logging.getLogger(__name__)
+
+gallery_students = metrics_utils.gauge('campuseye_gallery_students', 'Students in the in-memory gallery')
+gallery_sync_lag = metrics_utils.gauge('campuseye_gallery_sync_lag_seconds', 'Delay between a student write and the gallery applying it')
+
+GALLERY_PROJECTION = snapshot_utils.SNAPSHOT_PROJECTION
+
+
+def _template_matrix(templates_per_student):
+    """Stack per-student template lists into (templates, offsets)."""
+    counts = [len(t) for t in templates_per_student]
+    offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+    rows = [row for templates in templates_per_student for row in templates]
+    return np.asarray(rows, dtype=np.float32).reshape(-1, EMBEDDING_DIM), offsets
+
+
+class GalleryIndex:
+    """
+    In-memory matrix of every student template.
+    Student `student_ids[i]` owns rows offsets[i]:offsets[i + 1] of `templates`
+    (enrollment photos plus any templates learned from live matches).
+
+    Arrays are copy-on-write: mutations build new arrays and swap them in
+    under the lock, so searches can run outside the lock.
+
+    Search goes through matcher_utils.TemplateMatcher: a backend ('exact' or
+    'ivf') over per-student centroids, then min-over-templates refinement of
+    the top candidates.
+    """
+
+    def __init__(self, backend=None, aggregation=matcher_utils.TEMPLATE_AGGREGATION):
+        self.lock = threading.Lock()
+        self.matcher_class = matcher_utils.getMatcherClass(backend)
+        self.aggregation = aggregation
+        self.templates = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.matcher = self._matcher(self.templates, self.offsets)
+        self.student_ids = np.array([], dtype=object)
+        self.rows = {}      # studentId -> student row (index into offsets)
+        self.details = {}   # studentId -> {name, studentId, branch, photoUrl}
+        self.loaded = False
+
+    def _matcher(self, templates, offsets, previous=None):
+        return matcher_utils.TemplateMatcher(
+            templates, offsets, backend=self.matcher_class, previous=previous, aggregation=self.aggregation
+        )
+
+    def _swap(self, templates, offsets, student_ids, rebuild=False):
+        self.templates = templates
+        self.offsets = offsets
+        # incremental changes let the matcher reuse its trained state; full loads rebuild it
+        previous = None if rebuild else self.matcher
+        self.matcher = self._matcher(templates, offsets, previous=previous)
+        self.student_ids = student_ids
+        self.rows = {s_id: i for i, s_id in enumerate(student_ids)}
+
+    def _splice(self, row, new_templates):
+        """Arrays with student `row`'s templates replaced by `new_templates` (None removes the student)."""
+        lo, hi = self.offsets[row], self.offsets[row + 1]
+        parts = [self.templates[:lo]] + ([new_templates] if new_templates is not None else []) + [self.templates[hi:]]
+        templates = np.concatenate(parts)
+        counts = np.diff(self.offsets)
+        if new_templates is None:
+            counts = np.delete(counts, row)
+        else:
+            counts = counts.copy()
+            counts[row] = len(new_templates)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return templates, offsets
+
+    def load(self, students):
+        """Replace the whole index with the given student documents."""
+        ids = []
+        per_student = []
+        details = {}
+        for s in students:
+            templates = snapshot_utils.studentTemplates(s)
+            if not templates or 'studentId' not in s:
+                continue
+            ids.append(s['studentId'])
+            per_student.append(templates)
+            details[s['studentId']] = _details(s)
+
+        templates, offsets = _template_matrix(per_student)
+        self.loadArrays(templates, offsets, ids, details)
+
+    def loadArrays(self, templates, offsets, student_ids, details):
+        """Replace the whole index with a ready-made matrix (e.g. a memory-mapped snapshot)."""
+        student_ids = np.array(student_ids, dtype=object)
+        # Swap in one go so searches never see a half-built index
+        with self.lock:
+            self._swap(templates, np.asarray(offsets, dtype=np.int64), student_ids, rebuild=True)
+            self.details = details
+            self.loaded = True
+
+    def upsert(self, student):
+        """Insert or replace a single student."""
+        templates = snapshot_utils.studentTemplates(student)
+        if not templates:
+            self.remove(student['studentId'])
+            return
+
+        s_id = student['studentId']
+        vectors = np.asarray(templates, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        with self.lock:
+            row = self.rows.get(s_id)
+            if row is None:
+                all_templates = np.vstack([self.templates, vectors])
+                offsets = np.append(self.offsets, self.offsets[-1] + len(vectors))
+                student_ids = np.append(self.student_ids, np.array([s_id], dtype=object))
+            else:
+                all_templates, offsets = self._splice(row, vectors)
+                student_ids = self.student_ids
+            self._swap(all_templates, offsets, student_ids)
+            self.details[s_id] = _details(student)
+
+    def remove(self, student_id):
+        with self.lock:
+            row = self.rows.get(student_id)
+            self.details.pop(student_id, None)
+            if row is None:
+                return
+            templates, offsets = self._splice(row, None)
+            keep = np.arange(len(self.student_ids)) != row
+            self._swap(templates, offsets, self.student_ids[keep])
+
+    def size(self):
+        return len(self.student_ids)
+
+    def getDetails(self, student_ids):
+        with self.lock:
+            return [dict(self.details[s_id]) for s_id in student_ids if s_id in self.details]
+
+    def search(self, target_embeddings, threshold=mongo_utils.DISTANCE_THRESHOLD, k=TOP_K):
+        """
+        Match every target embedding against the gallery in one batched computation.
+        Returns one list per target of {'_id': studentId, 'distance': float},
+        sorted by distance and limited to `k` entries under `threshold`.
+        """
+        targets = np.asarray(target_embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+
+        with self.lock:
+            matcher = self.matcher
+            student_ids = self.student_ids
+
+        if len(targets) == 0:
+            return []
+
+        rows, dists = matcher.search(targets, k)
+
+        results = []
+        for row_ids, row_dists in zip(rows, dists):
+            matches = []
+            for i, d in zip(row_ids, row_dists):
+                if d > threshold:
+                    break
+                matches.append({'_id': student_ids[i], 'distance': float(d)})
+            results.append(matches)
+        return results
+
+
+def _details(student):
+    return {
+        'name': student.get('name'),
+        'studentId': student['studentId'],
+        'branch': student.get('branch'),
+        'photoUrl': student.get('photoUrl')
+    }
+
+
+class GallerySync:
+    """
+    Keeps a GalleryIndex in step with the students collection.
+
+    Does one bulk load, then applies inserts/updates/deletes incrementally
+    from a change stream. Deployments without change streams (standalone
+    mongod, mongomock) fall back to polling on `updatedAt`.
+
+    When a snapshot written by sync_gallery.py exists, the bulk load maps
+    it from disk and only fetches students changed since it from Mongo.
+    """
+
+    def __init__(self, collection, index, poll_interval=POLL_INTERVAL, snapshot_path=None):
+        self._collection = collection   # None: mongo_utils' students collection, resolved on first use
+        self.index = index
+        self.poll_interval = poll_interval
+        self.snapshot_path = snapshot_path
+        self.snapshot_version = None
+        self.mode = None
+        self.last_sync_lag = None   # seconds between a DB change and it being applied
+        self.last_sync_at = None
+        self.applied_changes = 0
+        self._object_ids = {}       # Mongo _id -> studentId, delete events only carry _id
+        self._versions = {}         # Mongo _id -> updatedAt last applied; polls skip unchanged documents
+        self._last_updated_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            self._collection = mongo_utils.students_collection
+        return self._collection
+
+    # ---------- loading ----------
+
+    def initialLoad(self):
+        if self.snapshot_path is not None:
+            try:
+                snapshot = snapshot_utils.loadSnapshot(self.snapshot_path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning('Could not read gallery snapshot %s: %s', self.snapshot_path, e)
+                snapshot = None
+            if snapshot is not None:
+                self._loadFromSnapshot(snapshot)
+                return
+
+        students = list(self.collection.find({}, GALLERY_PROJECTION))
+        self._object_ids = {s['_id']: s['studentId'] for s in students if 'studentId' in s}
+        self._versions = {s['_id']: s.get('updatedAt') for s in students}
+        stamps = [s['updatedAt'] for s in students if s.get('updatedAt')]
+        self._last_updated_at = max(stamps) if stamps else None
+        self.index.load(students)
+        self._mark_synced(None)
+
+    def _loadFromSnapshot(self, snapshot):
+        # only students written since the snapshot, plus the _id list to spot deletes
+        changed = list(self.collection.find(snapshot_utils.deltaQuery(snapshot), GALLERY_PROJECTION))
+        # the snapshot stores _id as text; map it back through the ids Mongo returns
+        current = {str(doc['_id']): doc['_id'] for doc in self.collection.find({}, {'_id': 1})}
+        changed_object_ids = {str(doc['_id']) for doc in changed}
+        changed_student_ids = {doc.get('studentId') for doc in changed}
+
+        keep = np.array([
+            s['_id'] in current and s['_id'] not in changed_object_ids and s['studentId'] not in changed_student_ids
+            for s in snapshot.students
+        ], dtype=bool)
+        kept = [s for s, k in zip(snapshot.students, keep) if k]
+        added = [(doc, snapshot_utils.studentTemplates(doc)) for doc in changed]
+        added = [(doc, templates) for doc, templates in added if templates and 'studentId' in doc]
+
+        # untouched snapshots stay a zero-copy view of the mapped file
+        if keep.all():
+            templates, offsets = snapshot.embeddings, snapshot.offsets
+        else:
+            templates = snapshot.embeddings[np.repeat(keep, np.diff(snapshot.offsets))]
+            offsets = np.concatenate([[0], np.cumsum([s['templates'] for s in kept], dtype=np.int64)])
+        if added:
+            new_templates, new_offsets = _template_matrix([t for _, t in added])
+            templates = np.vstack([templates, new_templates])
+            offsets = np.concatenate([offsets, offsets[-1] + new_offsets[1:]])
+        rows = kept + [doc for doc, _ in added]
+        self.index.loadArrays(templates, offsets, [s['studentId'] for s in rows],
+                              {s['studentId']: _details(s) for s in rows})
+
+        self._object_ids = {current[s['_id']]: s['studentId'] for s in kept}
+        self._object_ids.update({doc['_id']: doc['studentId'] for doc in changed if 'studentId' in doc})
+        # kept students predate every updatedAt the next poll asks for, so any version marks them as known
+        self._versions = {current[s['_id']]: None for s in kept}
+        self._versions.update({doc['_id']: doc.get('updatedAt') for doc in changed})
+        stamps = [doc['updatedAt'] for doc in changed if doc.get('updatedAt')]
+        if snapshot.last_updated_at is not None:
+            stamps.append(snapshot.last_updated_at)
+        self._last_updated_at = max(stamps) if stamps else None
+        self.snapshot_version = snapshot.version
+        self._mark_synced(None)
+        logger.info('Gallery loaded from snapshot %s (%d student(s)) plus %d change(s) from Mongo',
+                    snapshot.version, len(kept), len(changed))
+
+    def start(self):
+        # open the change stream before loading, so writes made during the
+        # load are replayed from the stream instead of being lost
+        stream = self._openStream()
+        self.initialLoad()
+        self._thread = threading.Thread(target=self._run, args=(stream,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'students': self.index.size(),
+            'last_sync_lag': self.last_sync_lag,
+            'last_sync_at': self.last_sync_at,
+            'applied_changes': self.applied_changes,
+            'snapshot_version': self.snapshot_version
+        }
+
+    def _run(self, stream):
+        if stream is not None:
+            try:
+                self._watch(stream)
+            except OperationFailure as e:
+                logger.warning('Change stream failed (%s), polling every %ss', e, self.poll_interval)
+        if not self._stop.is_set():
+            self._poll_loop()
+
+    def _mark_synced(self, changed_at):
+        now = datetime.utcnow()
+        self.last_sync_at = now
+        if changed_at is not None:
+            self.last_sync_lag = max((now - changed_at).total_seconds(), 0.0)
+        elif self.last_sync_lag is None:
+            self.last_sync_lag = 0.0
+        gallery_students.set(self.index.size())
+        gallery_sync_lag.set(self.last_sync_lag)
+
+    # ---------- change stream ----------
+
+    def _openStream(self, resume_token=None):
+        """A change stream on the collection, or None when change streams are unavailable."""
+        try:
+            return self.collection.watch(
+                full_document='updateLookup',
+                resume_after=resume_token,
+                max_await_time_ms=1000
+            )
+        except (OperationFailure, NotImplementedError, TypeError) as e:
+            # standalone mongod raises OperationFailure; mongomock has no watch()
+            logger.warning('Change streams unavailable (%s), polling every %ss', e, self.poll_interval)
+            return None
+
+    def _watch(self, stream):
+        self.mode = 'change_stream'
+        # the stream has a resume token from the moment it opens, so a reconnect
+        # before the first change still picks up exactly where it left off
+        resume_token = stream.resume_token
+        while not self._stop.is_set():
+            try:
+                if stream is None:
+                    stream = self.collection.watch(
+                        full_document='updateLookup',
+                        resume_after=resume_token,
+                        max_await_time_ms=1000
+                    )
+                    if resume_token is None:
+                        # nothing to resume from: reload now that the new stream is open
+                        self.initialLoad()
+                with stream:
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            if change['operationType'] in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                                # the stream ends here and can't be resumed
+                                resume_token = None
+                                break
+                            self.applyChange(change)
+                        resume_token = stream.resume_token or resume_token
+            except OperationFailure:
+                if resume_token is None:
+                    raise
+                # stale resume token: start a fresh stream and reload
+                resume_token = None
+            except PyMongoError as e:
+                logger.warning('Gallery change stream error: %s, reconnecting', e)
+                time.sleep(1)
+            stream = None
+
+    def applyChange(self, change):
+        op = change['operationType']
+        object_id = change.get('documentKey', {}).get('_id')
+
+        if op in ('insert', 'update', 'replace'):
+            doc = change.get('fullDocument')
+            if doc is None:
+                # document was deleted before the lookup ran; the delete event follows
+                return
+            old_id = self._object_ids.get(object_id)
+            if old_id is not None and old_id != doc.get('studentId'):
+                self.index.remove(old_id)
+            if 'studentId' not in doc:
+                self._object_ids.pop(object_id, None)
+            else:
+                self._object_ids[object_id] = doc['studentId']
+                self.index.upsert(doc)
+            self._versions[object_id] = doc.get('updatedAt')
+        elif op == 'delete':
+            self._versions.pop(object_id, None)
+            student_id = self._object_ids.pop(object_id, None)
+            if student_id is not None:
+                self.index.remove(student_id)
+        elif op in ('drop', 'invalidate'):
+            self.initialLoad()
+            return
+        else:
+            return
+
+        self.applied_changes += 1
+        wall_time = change.get('wallTime')
+        if wall_time is None and change.get('clusterTime') is not None:
+            wall_time = datetime.utcfromtimestamp(change['clusterTime'].time)
+        self._mark_synced(wall_time)
+
+    # ---------- polling fallback ----------
+
+    def _poll_loop(self):
+        self.mode = 'polling'
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except PyMongoError as e:
+                logger.warning('Gallery poll error: %s', e)
+
+    def poll(self):
+        """Apply inserts/updates newer than the last seen `updatedAt`, then drop deleted students."""
+        query = {}
+        if self._last_updated_at is not None:
+            # $gte so writes landing in the same millisecond aren't missed; upserts are idempotent
+            query = {'updatedAt': {'$gte': self._last_updated_at}}
+
+        changed = False
+        changed_at = None
+        for doc in self.collection.find(query, GALLERY_PROJECTION).sort('updatedAt', 1):
+            object_id = doc['_id']
+            updated_at = doc.get('updatedAt')
+            if updated_at is not None:
+                self._last_updated_at = updated_at
+            # the $gte boundary returns the newest document again on every poll
+            if object_id in self._versions and self._versions[object_id] == updated_at:
+                continue
+            self._versions[object_id] = updated_at
+
+            old_id = self._object_ids.get(object_id)
+            if old_id is not None and old_id != doc.get('studentId'):
+                self.index.remove(old_id)
+            if 'studentId' not in doc:
+                self._object_ids.pop(object_id, None)
+            else:
+                self._object_ids[object_id] = doc['studentId']
+                self.index.upsert(doc)
+            self.applied_changes += 1
+            changed = True
+            if updated_at is not None:
+                changed_at = updated_at
+
+        # deletes leave no updatedAt trace, so diff the id set
+        current = {doc['_id'] for doc in self.collection.find({}, {'_id': 1})}
+        for object_id in set(self._versions) - current:
+            self._versions.pop(object_id)
+            student_id = self._object_ids.pop(object_id, None)
+            if student_id is not None:
+                self.index.remove(student_id)
+            self.applied_changes += 1
+            changed = True
+
+        if changed:
+            self._mark_synced(changed_at)
+        else:
+            self.last_sync_at = datetime.utcnow()
+
+
+gallery = GalleryIndex()
+gallery_sync = GallerySync(None, gallery, snapshot_path=snapshot_utils.SNAPSHOT_DIR)
+
+
+def startSync():
+    gallery_sync.start()
+    logger.info('Gallery loaded: %d student(s)', gallery.size())
+
+
+def getGallery():
+    if not gallery.loaded:
+        gallery_sync.initialLoad()
+    return gallery
+
+
+def getSuspectsDetails(suspect_ids):
+    return getGallery().getDetails(suspect_ids)
+
+
+def findMatches(target_embeddings):
+    return getGallery().search(target_embeddings)
+
+
+class TemplateLearner:
+    """
+    Adds a live capture to a student's `liveTemplates` when the match is
+    unambiguous: close to the student, clearly further from everyone else,
+    and different enough from the templates already stored. The write goes
+    to Mongo and comes back into every gallery through the normal sync.
+    """
+
+    def __init__(self, collection, max_distance=SELF_UPDATE_DISTANCE, margin=SELF_UPDATE_MARGIN,
+                 min_novelty=SELF_UPDATE_MIN_NOVELTY, interval=SELF_UPDATE_INTERVAL,
+                 max_live=MAX_LIVE_TEMPLATES):
+        self._collection = collection   # None: mongo_utils' students collection, resolved on first use
+        self.max_distance = max_distance
+        self.margin = margin
+        self.min_novelty = min_novelty
+        self.interval = interval
+        self.max_live = max_live
+        self.lock = threading.Lock()
+        self.last_learned = {}   # studentId -> time of the last learned template
+        self.learned = 0
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            self._collection = mongo_utils.students_collection
+        return self._collection
+
+    def consider(self, embedding, matches, now=None):
+        """`matches` is the search result for this face. Returns True if a template was stored."""
+        if not matches:
+            return False
+        best = matches[0]
+        # with min aggregation the distance is to the closest existing template
+        if best['distance'] > self.max_distance or best['distance'] < self.min_novelty:
+            return False
+        if len(matches) > 1 and matches[1]['distance'] - best['distance'] < self.margin:
+            return False
+
+        now = time.time() if now is None else now
+        student_id = best['_id']
+        with self.lock:
+            last = self.last_learned.get(student_id)
+            if last is not None and now - last < self.interval:
+                return False
+            self.last_learned[student_id] = now
+
+        try:
+            self.collection.update_one(
+                {'studentId': student_id},
+                {
+                    '$push': {'liveTemplates': {'$each': [list(map(float, embedding))], '$slice': -self.max_live}},
+                    '$set': {'updatedAt': datetime.utcnow()}
+                }
+            )
+        except PyMongoError as e:
+            logger.warning('Could not store learned template for %s: %s', student_id, e)
+            return False
+        with self.lock:
+            self.learned += 1
+        logger.info('Learned a new template for %s (distance %.2f)', student_id, best['distance'])
+        return True
+
+
+template_learner = TemplateLearner(None)
+
+
+def learnFromMatch(embedding, matches):
+    if SELF_UPDATE:
+        template_learner.consider(embedding, matches)
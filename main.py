@@ -1,27 +1,30 @@
 import cv2
 import pytz
-import threading
-import sys
+import argparse
+import logging
 import time
-import csv
 from io import BytesIO
-import requests
 import os
 from dotenv import load_dotenv
-from datetime import datetime, time as time_type
+from datetime import datetime, timezone, time as time_type
 
 import model_utils
 import mongo_utils
+import gallery_utils
+import camera_utils
+import attendance_utils
+import alert_utils
+import metrics_utils
+import schedule_utils
+import notify_utils
+
+logger = logging.getLogger(__name__)
 
-# Debug: Log .env file path and contents
 env_path = os.path.join(os.path.dirname(__file__), '.env')
-print(f"Loading .env from: {env_path}")
 if os.path.exists(env_path):
-    with open(env_path, 'r') as f:
-        print(f".env contents: {f.read()}")
+    load_dotenv(env_path)
 else:
-    print("Error: .env file not found")
-load_dotenv(env_path)
+    logger.warning('.env not found at %s', env_path)
 
 TIME_ZONE = pytz.timezone('Asia/Kolkata')
 
@@ -35,85 +38,96 @@ TIME_SLOTS = [
     (time_type(20, 50), time_type(23, 59)),
     (time_type(1, 20), time_type(2, 0))     
 ]
+# Slots may overlap or cross midnight, e.g. (time_type(22, 0), time_type(6, 0))
+slot_schedule = schedule_utils.SlotSchedule(TIME_SLOTS, TIME_ZONE)
 
 # --------------------------------------------------
 # Global State for "Email Once" & CSV Logic
 # --------------------------------------------------
-notified_students = set()
-csv_lock = threading.Lock()  # Prevents file corruption when multiple threads write
+frames_processed = metrics_utils.counter('campuseye_frames_processed', 'Frames run through recognition')
+frames_failed = metrics_utils.counter('campuseye_frames_failed', 'Frames whose recognition raised an error')
+students_detected = metrics_utils.counter('campuseye_students_detected', 'Matched students logged to attendance')
+alerts_enqueued = metrics_utils.counter('campuseye_alerts_enqueued', 'Alerts handed to the dispatcher', ['kind'])
+notification_state = None  # notify_utils.NotificationState, created by init_services()
+attendance_log = None      # attendance_utils.AttendanceLog, created by init_services()
+alert_dispatcher = None    # alert_utils.AlertDispatcher, created by init_services()
+
+
+def on_alert_given_up(alert):
+    # If the email could not be delivered, forget it so the next detection alerts again.
+    # The claim stands for the email; a failed Telegram alert doesn't warrant resending it.
+    if alert['kind'] != 'email':
+        return
+    student_id = alert['payload'].get('studentId')
+    if student_id is not None:
+        notification_state.release(student_id)
+
+
+def init_services(attendance_file=attendance_utils.ATTENDANCE_FILE,
+                  event_log=attendance_utils.EVENT_LOG_FILE,
+                  spool_dir=alert_utils.SPOOL_DIR):
+    """Start the attendance log, alert dispatcher and alert dedup state that check_frame uses."""
+    global attendance_log, alert_dispatcher, notification_state
+    # one alert per student per day (and per NOTIFY_TTL); shared across restarts and processes
+    notification_state = notify_utils.NotificationState(tz=TIME_ZONE)
+    attendance_log = attendance_utils.AttendanceLog(attendance_file, event_log)
+    attendance_log.start()
+    alert_dispatcher = alert_utils.AlertDispatcher(spool_dir=spool_dir, on_give_up=on_alert_given_up)
+    alert_dispatcher.start()
+
+
+def shutdown_services():
+    alert_dispatcher.stop()
+    attendance_log.close()
+    mongo_utils.detection_writer.close()
+
 
 def log_to_csv(name, student_id, branch, timestamp_str):
     """
-    Updates attendance.csv.
+    Records a detection in attendance.csv.
     If student+date exists: appends timestamp to the row.
     If not: creates a new row.
+    Writes go to an append-only event log; attendance.csv is rewritten in the background.
     """
-    filename = 'attendance.csv'
     current_date = datetime.now().strftime("%Y-%m-%d")
-    rows = []
-    found = False
-
-    with csv_lock:  # Ensure only one thread writes at a time
-        # 1. Read existing data
-        if os.path.isfile(filename):
-            with open(filename, 'r', newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    # Row format: Name, ID, Branch, Date, Time1, Time2...
-                    # Check if this row belongs to the student AND the current date
-                    if len(row) >= 4 and row[1] == student_id and row[3] == current_date:
-                        if timestamp_str not in row:
-                            row.append(timestamp_str)
-                        found = True
-                    rows.append(row)
-        
-        # 2. If not found, add new row
-        if not found:
-            # New row: Name, ID, Branch, Date, Time1
-            rows.append([name, student_id, branch, current_date, timestamp_str])
-
-        # 3. Write back to file
-        with open(filename, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(rows)
-            print(f"Logged to CSV: {name} at {timestamp_str}")
+    with metrics_utils.timed('log'):
+        attendance_log.record(name, student_id, branch, current_date, timestamp_str)
+    logger.debug('Logged to CSV: %s at %s', name, timestamp_str)
 
 
 def is_within_time_slots():
     """Check if current time is within any of the defined time slots."""
-    current_time = datetime.now(TIME_ZONE).time()  
-    for start_time, end_time in TIME_SLOTS:
-        if start_time <= current_time <= end_time:
-            return True
-    return False
+    return slot_schedule.isActive()
 
-def check_frame(frame):
+def check_frame(frame, camera=None, captured_at=None, tracker=None):
+    """`tracker` is used when there is no camera; it defaults to model_utils.face_tracker."""
+    frames_processed.inc()
     try:
-        res = model_utils.findSuspects(frame)
+        if camera is not None:
+            res = model_utils.findSuspects(frame, tracker=camera.tracker)
+            camera.markFaces(res.get('num_faces', 0))
+        else:
+            res = model_utils.findSuspects(frame, tracker=tracker)
         found_suspect_ids = res['found_suspect_ids']
         suspects_img = res['suspects_img']
 
         num_suspects = len(found_suspect_ids)
 
         if num_suspects == 0:
-            print('no match found')
+            logger.debug('no match found')
             return
 
-        print(num_suspects, 'matche(s) found')
-
-        timestamp = time.strftime("%H:%M:%S") # Just time for the CSV columns
-        full_timestamp = time.strftime("%d/%m/%Y %H:%M:%S")
+        detected_at = datetime.now().astimezone()
+        timestamp = detected_at.strftime("%H:%M:%S") # Just time for the CSV columns
+        full_timestamp = detected_at.strftime(mongo_utils.DETECTION_TIMESTAMP_FORMAT)
 
-        print("At:", full_timestamp)
-        print('\n--------found ids---------')
-        print(found_suspect_ids)
-        print('--------------------------\n')
+        logger.info('%d match(es) found at %s: %s', num_suspects, full_timestamp, found_suspect_ids)
 
         # Encode the frame (with bounding box) to JPEG bytes
         _, img_encoded = cv2.imencode('.jpg', suspects_img)
         img_bytes = img_encoded.tobytes()
 
-        suspects_details = mongo_utils.getSuspectsDetails(found_suspect_ids)
+        suspects_details = gallery_utils.getSuspectsDetails(found_suspect_ids)
         
         detection_records = []
         for suspect in suspects_details:
@@ -123,19 +137,17 @@ def check_frame(frame):
 
             # 1. ALWAYS Log to CSV (Continuous)
             log_to_csv(s_name, s_id, s_branch, timestamp)
+            students_detected.inc()
 
-            # 2. CHECK if email already sent
-            if s_id not in notified_students:
-                # FIX: Add to set IMMEDIATELY to block other threads from sending duplicates
-                # while this thread is busy uploading the image.
-                notified_students.add(s_id)
-                
-                print(f"Sending First Alert for {s_name}...")
+            # 2. CHECK if email already sent: one atomic check-and-set, so concurrent
+            # workers (or other camera processes) can't both alert for the same student
+            if notification_state.claim(s_id):
                 
+                logger.info('Sending first alert for %s (%s)', s_name, s_id)
+
                 caption = 'Student Name: {}\n Student Id: {}\n Branch: {}\n Found At: {}\n'.format(
                     s_name, s_id, s_branch, full_timestamp
                 )
-                print(caption)
 
                 # Prepare data for Email
                 data_payload = {
@@ -146,30 +158,16 @@ def check_frame(frame):
                     'photoUrl': suspect['photoUrl']
                 }
                 
-                files_payload = {
-                    'live_image': ('capture.jpg', img_bytes, 'image/jpeg')
-                }
-
                 recipient_email = os.getenv('RECIPIENT_EMAIL')
                 if recipient_email:
                     data_payload['to_email'] = recipient_email
-                    
-                try:
-                    response = requests.post(
-                        'http://localhost:5000/send-email', 
-                        data=data_payload, 
-                        files=files_payload
-                    )
-                    print(f"Email Status: {response.status_code}")
-                    
-                    # If email failed, remove from set so we try again next time
-                    if response.status_code != 200:
-                        print("Email failed, removing from notified list to retry.")
-                        notified_students.remove(s_id)
-                        
-                except requests.RequestException as e:
-                    print(f"Failed to send email: {str(e)}")
-                    notified_students.remove(s_id)
+
+                # Delivery (upload, EmailJS, retries) happens on the dispatcher thread
+                alert_dispatcher.enqueue('email', data_payload, img_bytes)
+                alerts_enqueued.inc(kind='email')
+                if os.getenv('BOT_TOKEN'):
+                    alert_dispatcher.enqueue('telegram', {'caption': caption, 'studentId': s_id}, img_bytes)
+                    alerts_enqueued.inc(kind='telegram')
 
                 # Log to MongoDB only on the FIRST detection (Email event)
                 detection_records.append({
@@ -177,57 +175,112 @@ def check_frame(frame):
                     'name': s_name,
                     'branch': s_branch,
                     'timestamp': full_timestamp,
+                    'ts': detected_at.astimezone(timezone.utc),
                     'photoUrl': suspect['photoUrl']
                 })
 
-        # Store detection record in MongoDB (Only for the email event)
+        # Store detection record in MongoDB (Only for the email event);
+        # buffered and written in batches by mongo_utils.detection_writer
         if detection_records:
             mongo_utils.store_detection_records(detection_records)
 
     except Exception as e:
-        print(f"Error in check_frame: {e}")
+        frames_failed.inc()
+        logger.exception('Error in check_frame: %s', e)
+    finally:
+        if camera is not None and captured_at is not None:
+            camera.latency.record(time.perf_counter() - captured_at)
 
 WINDOW_WIDTH = 640
 WINDOW_HEIGHT = 480
 
-cap = cv2.VideoCapture(0)
-
-if not cap.isOpened():
-    print("Error opening camera")
-    sys.exit()
-
-cv2.namedWindow("Camera", cv2.WINDOW_NORMAL)
-cv2.resizeWindow("Camera", WINDOW_WIDTH, WINDOW_HEIGHT)
-
-WAIT_DURATION = 4
-FRAME_RATE = 30
-target_frame = WAIT_DURATION * FRAME_RATE
-frame_counter = 0
-
-while True:
-    ret, frame = cap.read()
-
-    if not ret:
-        print("Error in reading frame from camera")
-        break
-
-    # Only process frame if within specified time slots
-    if is_within_time_slots():
-        if frame_counter % target_frame == 0:
-            try:
-                threading.Thread(target=check_frame, args=(frame.copy(),), daemon=True).start()
-            except Exception as e:
-                print(f'Error in creating new thread: {e}')
-    else:
-        if frame_counter % 30 == 0: 
-            print(f"Skipping detection: Time {datetime.now(TIME_ZONE).time()} outside slots")
-
-    frame_counter += 1
-
-    cv2.imshow('Camera', frame)
-
-    if cv2.waitKey(1) == ord('q'):
-        break
-
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+# Seconds between frames sent to recognition; the camera's real FPS no longer matters.
+# Sampling speeds up to ACTIVE while faces are in view and backs off while recognition is behind.
+IDLE_SAMPLE_INTERVAL = float(os.getenv('IDLE_SAMPLE_INTERVAL', schedule_utils.IDLE_INTERVAL))
+ACTIVE_SAMPLE_INTERVAL = float(os.getenv('ACTIVE_SAMPLE_INTERVAL', schedule_utils.ACTIVE_INTERVAL))
+STATS_INTERVAL = 600  # seconds between stats printouts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CampusEye camera process')
+    parser.add_argument('--source', action='append',
+                        help='camera index, RTSP URL or video file; repeat for several cameras '
+                             '(default: CAMERA_SOURCES env, comma-separated, or 0)')
+    parser.add_argument('--headless', action='store_true', default=os.getenv('HEADLESS') == '1',
+                        help='no preview windows')
+    parser.add_argument('--metrics-port', type=int, default=int(os.getenv('METRICS_PORT', 0)),
+                        help='serve Prometheus /metrics on this port (default: METRICS_PORT env, off)')
+    args = parser.parse_args()
+
+    metrics_utils.setupLogging()
+    if args.metrics_port:
+        metrics_utils.startServer(args.metrics_port)
+
+    init_services()
+    sources = args.source or [s for s in os.getenv('CAMERA_SOURCES', '0').split(',') if s.strip()]
+
+    # Build and warm up the model while the gallery loads and the cameras open;
+    # recognition workers wait for it, so the first detection still costs the
+    # same as every later one
+    model_utils.loadModelInBackground()
+
+    # Load every student embedding into memory once and keep it in sync with
+    # add/edit/delete from the dashboard; matching no longer queries Mongo per face
+    gallery_utils.startSync()
+
+    # One capture thread per camera, all feeding one fixed worker pool with a
+    # small latest-wins queue: a slow recognizer drops stale frames instead of
+    # piling up threads
+    supervisor = camera_utils.CameraSupervisor(
+        sources,
+        check_frame,
+        should_process=is_within_time_slots,
+        idle_interval=IDLE_SAMPLE_INTERVAL,
+        active_interval=ACTIVE_SAMPLE_INTERVAL,
+        face_check=os.getenv('GATE_FACE_CHECK') == '1'
+    )
+    logger.info('Detection slots: %s', slot_schedule.describe())
+    supervisor.start()
+
+    if not args.headless:
+        for camera in supervisor.cameras:
+            cv2.namedWindow(camera.name, cv2.WINDOW_NORMAL)
+            cv2.resizeWindow(camera.name, WINDOW_WIDTH, WINDOW_HEIGHT)
+
+    last_stats = time.monotonic()
+    last_slot_notice = 0.0
+    try:
+        while not supervisor.allFinished():
+            now = time.monotonic()
+            if not is_within_time_slots() and now - last_slot_notice >= 1:
+                logger.debug('Skipping detection: time %s outside slots', datetime.now(TIME_ZONE).time())
+                last_slot_notice = now
+            if now - last_stats >= STATS_INTERVAL:
+                logger.info('Camera stats: %s', supervisor.stats())
+                last_stats = now
+
+            if args.headless:
+                time.sleep(0.1)
+                continue
+
+            for camera in supervisor.cameras:
+                frame = camera.getFrame()
+                if frame is not None:
+                    cv2.imshow(camera.name, frame)
+            if cv2.waitKey(1) == ord('q'):
+                break
+    except KeyboardInterrupt:
+        pass
+
+    if supervisor.allFinished():
+        # video files ended: let queued frames finish before shutting down
+        supervisor.pipeline.waitIdle(timeout=60)
+    supervisor.stop()
+    logger.info('Camera stats: %s', supervisor.stats())
+    shutdown_services()
+    if not args.headless:
+        cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    main()
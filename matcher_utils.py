@@ -0,0 +1,197 @@
+import os
+import numpy as np
+
+MATCHER_BACKEND = os.getenv('MATCHER_BACKEND', 'exact')  # 'exact' or 'ivf'
+IVF_N_PROBE = int(os.getenv('IVF_N_PROBE', '8'))
+TEMPLATE_AGGREGATION = os.getenv('TEMPLATE_AGGREGATION', 'min')  # 'min' or 'centroid'
+REFINE_CANDIDATES = int(os.getenv('REFINE_CANDIDATES', '32'))  # students re-scored against every template
+KMEANS_ITERATIONS = 10
+
+
+def _sq_norms(x):
+    return np.einsum('ij,ij->i', x, x)
+
+
+def _pairwise_distances(targets, embeddings, sq_norms):
+    # ||a - b||^2 = ||a||^2 - 2ab + ||b||^2 for all (target, row) pairs at once
+    sq_dists = _sq_norms(targets)[:, None] - 2.0 * targets @ embeddings.T + sq_norms[None, :]
+    return np.sqrt(np.maximum(sq_dists, 0.0))
+
+
+def _top_k(dists, k):
+    """Indices and distances of the k smallest entries of each row, sorted ascending."""
+    k = min(k, dists.shape[1])
+    if k < dists.shape[1]:
+        top = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(dists.shape[1]), (dists.shape[0], 1))
+    top_dists = np.take_along_axis(dists, top, axis=1)
+    order = np.argsort(top_dists, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_dists, order, axis=1)
+
+
+class ExactMatcher:
+    """Brute-force L2 search over every gallery row."""
+
+    name = 'exact'
+
+    def __init__(self, embeddings, previous=None):
+        self.embeddings = embeddings
+        self.sq_norms = _sq_norms(embeddings)
+
+    def search(self, targets, k):
+        """
+        Returns (rows, distances), each of shape (len(targets), <=k), sorted by distance.
+        """
+        if len(self.embeddings) == 0:
+            return np.zeros((len(targets), 0), dtype=int), np.zeros((len(targets), 0))
+        dists = _pairwise_distances(targets, self.embeddings, self.sq_norms)
+        return _top_k(dists, k)
+
+
+class IVFMatcher:
+    """
+    Inverted-file index: k-means splits the gallery into `n_lists` cells and
+    a query is only compared against the rows in its `n_probe` nearest cells.
+
+    Passing the previous IVFMatcher keeps its centroids, so incremental
+    gallery updates only re-assign rows instead of re-training.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, embeddings, previous=None, n_probe=IVF_N_PROBE, n_lists=None, seed=0):
+        self.embeddings = embeddings
+        self.sq_norms = _sq_norms(embeddings)
+        self.n_probe = n_probe
+
+        n = len(embeddings)
+        if previous is not None and previous.trained_size * 2 >= n and len(previous.centroids):
+            self.centroids = previous.centroids
+            self.trained_size = previous.trained_size
+        else:
+            n_lists = n_lists or max(1, int(np.sqrt(n)))
+            self.centroids = self._train(embeddings, n_lists, seed)
+            self.trained_size = n
+
+        if n:
+            assign = self._nearest_centroids(embeddings, 1)[:, 0]
+        else:
+            assign = np.zeros(0, dtype=int)
+        # CSR layout: rows of list c are order[offsets[c]:offsets[c + 1]]
+        self.order = np.argsort(assign, kind='stable')
+        self.offsets = np.searchsorted(assign[self.order], np.arange(len(self.centroids) + 1))
+
+    @staticmethod
+    def _train(embeddings, n_lists, seed):
+        if len(embeddings) == 0:
+            return np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(embeddings), n_lists * 64)
+        sample = embeddings[rng.choice(len(embeddings), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            assign = np.argmin(_pairwise_distances(sample, centroids, _sq_norms(centroids)), axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=n_lists)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        return centroids
+
+    def _nearest_centroids(self, x, n):
+        dists = _pairwise_distances(x, self.centroids, _sq_norms(self.centroids))
+        return _top_k(dists, n)[0]
+
+    def search(self, targets, k):
+        if len(self.embeddings) == 0:
+            return np.zeros((len(targets), 0), dtype=int), np.zeros((len(targets), 0))
+
+        probes = self._nearest_centroids(targets, self.n_probe)
+        k = min(k, len(self.embeddings))
+        rows = np.zeros((len(targets), k), dtype=int)
+        dists = np.full((len(targets), k), np.inf)
+
+        for t, cells in enumerate(probes):
+            candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in cells])
+            if len(candidates) == 0:
+                continue
+            cand_dists = _pairwise_distances(
+                targets[t:t + 1], self.embeddings[candidates], self.sq_norms[candidates]
+            )
+            top, top_dists = _top_k(cand_dists, k)
+            rows[t, :top.shape[1]] = candidates[top[0]]
+            dists[t, :top.shape[1]] = top_dists[0]
+        return rows, dists
+
+
+MATCHERS = {
+    ExactMatcher.name: ExactMatcher,
+    IVFMatcher.name: IVFMatcher
+}
+
+
+def getMatcherClass(backend=None):
+    backend = backend or MATCHER_BACKEND
+    if backend not in MATCHERS:
+        raise ValueError(f"Unknown matcher backend '{backend}'. Choose one of: {', '.join(MATCHERS)}")
+    return MATCHERS[backend]
+
+
+def templateCentroids(templates, offsets):
+    """Mean template of each student; student i owns templates[offsets[i]:offsets[i + 1]]."""
+    counts = np.diff(offsets)
+    if len(counts) == 0:
+        return np.zeros((0, templates.shape[1]), dtype=np.float32)
+    sums = np.add.reduceat(templates, offsets[:-1], axis=0)
+    return (sums / counts[:, None]).astype(np.float32)
+
+
+class TemplateMatcher:
+    """
+    Search over students that each have one or more templates.
+
+    A backend from MATCHERS indexes one centroid per student and picks the
+    `refine` nearest students. With 'min' aggregation those candidates are
+    re-scored by their closest template, in one vectorized pass over only
+    the candidates' templates, so cost grows with the candidate count and
+    not with the total number of templates. 'centroid' skips the refinement.
+    """
+
+    def __init__(self, templates, offsets, backend=ExactMatcher, previous=None,
+                 aggregation=TEMPLATE_AGGREGATION, refine=REFINE_CANDIDATES):
+        if aggregation not in ('min', 'centroid'):
+            raise ValueError(f"Unknown template aggregation '{aggregation}'. Choose 'min' or 'centroid'")
+        self.templates = templates
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.sq_norms = _sq_norms(templates)
+        self.aggregation = aggregation
+        self.refine = refine
+        self.centroids = templateCentroids(templates, self.offsets)
+        self.centroid_matcher = backend(
+            self.centroids, previous=previous.centroid_matcher if previous is not None else None
+        )
+
+    def search(self, targets, k):
+        """Returns (student rows, distances), each of shape (len(targets), <=k), sorted by distance."""
+        if self.aggregation == 'centroid' or len(self.centroids) == 0:
+            return self.centroid_matcher.search(targets, k)
+
+        cand_rows, cand_dists = self.centroid_matcher.search(targets, max(k, self.refine))
+        m, c = cand_rows.shape
+        starts = self.offsets[cand_rows].ravel()
+        counts = (self.offsets[cand_rows + 1] - self.offsets[cand_rows]).ravel()
+
+        # one (target, template) pair per template of every candidate
+        seg_starts = np.cumsum(counts) - counts
+        pair_template = np.repeat(starts - seg_starts, counts) + np.arange(counts.sum())
+        pair_target = np.repeat(np.arange(m), counts.reshape(m, c).sum(axis=1))
+        t = targets[pair_target]
+        sq = _sq_norms(t) - 2.0 * np.einsum('ij,ij->i', t, self.templates[pair_template]) + self.sq_norms[pair_template]
+
+        dists = np.sqrt(np.maximum(np.minimum.reduceat(sq, seg_starts), 0.0)).reshape(m, c)
+        # IVF pads with inf when a query's cells hold fewer than c students
+        dists[~np.isfinite(cand_dists)] = np.inf
+        top, top_dists = _top_k(dists, k)
+        return np.take_along_axis(cand_rows, top, axis=1), top_dists
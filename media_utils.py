@@ -0,0 +1,329 @@
+import hashlib
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+import metrics_utils
+
+MEDIA_BACKEND = os.getenv('MEDIA_BACKEND', 'cloudinary')   # 'cloudinary' or 'local'
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media_cache'))
+MEDIA_LOCAL_DIR = os.getenv('MEDIA_LOCAL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media_uploads'))
+MEDIA_LOCAL_URL = os.getenv('MEDIA_LOCAL_URL')             # local backend: base URL the upload dir is served from
+# cached images are served at <MEDIA_PUBLIC_URL>/media/<hash>.jpg until their upload finishes
+MEDIA_PUBLIC_URL = os.getenv('MEDIA_PUBLIC_URL', '').rstrip('/')
+MEDIA_URL_PATH = '/media/'
+UPLOAD_WORKERS = 4
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 2          # seconds before the first retry, doubled on every attempt
+CACHE_KEEP = 7 * 24 * 3600   # uploaded images stay in the local cache this long
+PRUNE_EVERY = 100            # prune the cache every N uploads
+
+logger = logging.getLogger(__name__)
+
+media_uploads = metrics_utils.counter('campuseye_media_uploads', 'Background media uploads by outcome', ['outcome'])
+media_uploads_pending = metrics_utils.gauge('campuseye_media_uploads_pending', 'Media uploads queued or in progress')
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+def digestOf(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def isDigest(value):
+    return bool(_DIGEST.match(value or ''))
+
+
+def localUrl(digest):
+    """URL the app serves a cached image at while its upload is pending."""
+    return f'{MEDIA_PUBLIC_URL}{MEDIA_URL_PATH}{digest}.jpg'
+
+
+def pendingUrl(digest):
+    """
+    URL to store for an image whose upload hasn't finished: the app's cache URL
+    when MEDIA_PUBLIC_URL makes it absolute, else None. A host-relative path
+    would be copied into detections and alert emails as a broken link.
+    """
+    return localUrl(digest) if MEDIA_PUBLIC_URL else None
+
+
+# --------------------------------------------------
+# Content-addressed cache
+# --------------------------------------------------
+
+class MediaCache:
+    """
+    Images on local disk keyed by the SHA-256 of their bytes, so the same
+    photo is stored (and uploaded) once. A `.url` file next to an image
+    records its remote URL once the upload has finished.
+    """
+
+    def __init__(self, directory=MEDIA_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest, ext='jpg'):
+        return os.path.join(self.directory, digest[:2], f'{digest}.{ext}')
+
+    def _write(self, path, data, mode='wb'):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, mode) as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def put(self, data):
+        """Store image bytes and return their digest. Writing the same bytes twice is a no-op."""
+        digest = digestOf(data)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            self._write(path, data)
+        return digest
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def remoteUrl(self, digest):
+        try:
+            with open(self.path(digest, 'url')) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def setRemoteUrl(self, digest, url):
+        self._write(self.path(digest, 'url'), url, mode='w')
+
+    def prune(self, keep=CACHE_KEEP, now=None):
+        """Delete images that were uploaded more than `keep` seconds ago. Their `.url` files stay."""
+        now = time.time() if now is None else now
+        removed = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.jpg'):
+                    continue
+                path = os.path.join(root, name)
+                if not os.path.exists(path[:-len('jpg')] + 'url'):
+                    continue   # still waiting to be uploaded
+                try:
+                    if now - os.path.getmtime(path) > keep:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+# --------------------------------------------------
+# Remote stores
+#
+# Each one implements upload(path, digest) -> public URL.
+# --------------------------------------------------
+
+_cloudinary_configured = False
+
+
+def configureCloudinary():
+    """Import and configure the Cloudinary SDK from CLOUD_NAME / API_KEY / API_SECRET, once."""
+    global _cloudinary_configured
+    if not _cloudinary_configured:
+        import cloudinary
+        cloudinary.config(
+            cloud_name=os.getenv('CLOUD_NAME'),
+            api_key=os.getenv('API_KEY'),
+            api_secret=os.getenv('API_SECRET')
+        )
+        _cloudinary_configured = True
+
+
+class CloudinaryBackend:
+    """The SDK is imported and configured on the first upload."""
+    name = 'cloudinary'
+
+    def upload(self, path, digest):
+        configureCloudinary()
+        from cloudinary.uploader import upload
+        # the digest as public_id makes a repeated upload of the same image land on the same asset
+        return upload(path, public_id=digest, overwrite=False)['secure_url']
+
+
+class LocalBackend:
+    """Copies images into a directory; for development and tests."""
+    name = 'local'
+
+    def __init__(self, directory=MEDIA_LOCAL_DIR, base_url=MEDIA_LOCAL_URL):
+        self.directory = directory
+        self.base_url = base_url
+        os.makedirs(directory, exist_ok=True)
+
+    def upload(self, path, digest):
+        name = f'{digest}.jpg'
+        target = os.path.join(self.directory, name)
+        if not os.path.exists(target):
+            shutil.copyfile(path, target)
+        if self.base_url:
+            return f"{self.base_url.rstrip('/')}/{name}"
+        return 'file://' + os.path.abspath(target)
+
+
+BACKENDS = {
+    CloudinaryBackend.name: CloudinaryBackend,
+    LocalBackend.name: LocalBackend
+}
+
+
+def getBackend(backend=None, **kwargs):
+    backend = backend or MEDIA_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown media backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+    return BACKENDS[backend](**kwargs)
+
+
+# --------------------------------------------------
+# Background uploader
+# --------------------------------------------------
+
+class MediaUploader:
+    """
+    Pushes cached images to the remote store from a small thread pool.
+
+    `submit(digest)` returns a Future resolving to the remote URL. An image
+    that is already uploaded resolves immediately from its `.url` file, and
+    concurrent submits of the same image share one upload. Failed uploads
+    are retried with exponential backoff; `on_done` callbacks only run on
+    success, with the URL.
+    """
+
+    def __init__(self, cache=None, backend=None, workers=UPLOAD_WORKERS,
+                 max_attempts=MAX_ATTEMPTS, backoff_base=BACKOFF_BASE):
+        self.cache = cache if cache is not None else MediaCache()
+        self.backend = backend if backend is not None else getBackend()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='media-upload')
+        self.lock = threading.Lock()
+        self.in_flight = {}   # digest -> Future
+        self.uploaded = 0
+        self.deduplicated = 0
+        self.failed = 0
+
+    def store(self, data):
+        """Cache image bytes; returns their digest."""
+        return self.cache.put(data)
+
+    def submit(self, digest, on_done=None):
+        with self.lock:
+            future = self.in_flight.get(digest)
+            if future is None:
+                url = self.cache.remoteUrl(digest)
+                if url is not None:
+                    self.deduplicated += 1
+                    media_uploads.inc(outcome='deduplicated')
+                    future = Future()
+                    future.set_result(url)
+                else:
+                    future = self.in_flight[digest] = self.pool.submit(self._upload, digest)
+                    media_uploads_pending.set(len(self.in_flight))
+        if on_done is not None:
+            future.add_done_callback(lambda f: self._call(on_done, f))
+        return future
+
+    def _call(self, on_done, future):
+        if future.exception() is not None:
+            return
+        try:
+            on_done(future.result())
+        except Exception as e:
+            logger.exception('Media upload callback failed: %s', e)
+
+    def _upload(self, digest):
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    with metrics_utils.timed('upload'):
+                        url = self.backend.upload(self.cache.path(digest), digest)
+                    break
+                except Exception as e:
+                    if attempt == self.max_attempts:
+                        with self.lock:
+                            self.failed += 1
+                        media_uploads.inc(outcome='failed')
+                        logger.warning('Giving up uploading %s after %d attempts: %s', digest[:12], attempt, e)
+                        raise
+                    delay = self.backoff_base * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+                    logger.info('Upload of %s failed (%s), retrying in %.1fs', digest[:12], e, delay)
+                    time.sleep(delay)
+
+            self.cache.setRemoteUrl(digest, url)
+            with self.lock:
+                self.uploaded += 1
+                prune = self.uploaded % PRUNE_EVERY == 0
+            media_uploads.inc(outcome='uploaded')
+            if prune:
+                self.cache.prune()
+            return url
+        finally:
+            with self.lock:
+                self.in_flight.pop(digest, None)
+                media_uploads_pending.set(len(self.in_flight))
+
+    def pending(self):
+        with self.lock:
+            return len(self.in_flight)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.in_flight),
+                'uploaded': self.uploaded,
+                'deduplicated': self.deduplicated,
+                'failed': self.failed
+            }
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+
+# --------------------------------------------------
+# Student photos
+# --------------------------------------------------
+
+def studentPhotoUpdater(collection, student_id, digest, on_updated=None):
+    """
+    on_done callback that sets a student's photoUrl to the uploaded one and
+    clears photoPending. Matching on photoHash leaves the document alone if a
+    newer photo replaced it in the meantime.
+    """
+    def update(url):
+        result = collection.update_one(
+            {'studentId': student_id, 'photoHash': digest},
+            {'$set': {'photoUrl': url, 'updatedAt': datetime.utcnow()}, '$unset': {'photoPending': ''}}
+        )
+        if result.modified_count and on_updated is not None:
+            on_updated(student_id, url)
+    return update
+
+
+def resumePending(uploader, collection, on_updated=None):
+    """Re-submit student photos whose upload didn't finish before the last shutdown."""
+    cursor = collection.find(
+        {'photoPending': True, 'photoHash': {'$exists': True}},
+        {'studentId': 1, 'photoHash': 1, '_id': 0}
+    )
+    resumed = 0
+    for student in cursor:
+        digest = student['photoHash']
+        if not uploader.cache.has(digest) and uploader.cache.remoteUrl(digest) is None:
+            logger.warning('Cached photo for %s is gone; re-upload it from the edit page', student['studentId'])
+            continue
+        uploader.submit(digest, studentPhotoUpdater(collection, student['studentId'], digest, on_updated))
+        resumed += 1
+    if resumed:
+        logger.info('Resumed %d pending photo upload(s)', resumed)
+    return resumed
@@ -0,0 +1,266 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# seconds; covers a cached lookup up to a cold TF forward pass or a slow email send
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+def setupLogging(level=None):
+    """Configure root logging once per process; LOG_LEVEL env (default INFO) picks the level."""
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    logging.basicConfig(level=level.upper() if isinstance(level, str) else level, format=LOG_FORMAT)
+
+
+# --------------------------------------------------
+# Metric types
+# --------------------------------------------------
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f'Expected labels {labelnames}, got {tuple(labels)}')
+    return tuple(str(labels[n]) for n in labelnames)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, key)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type_name = 'counter'
+    suffix = '_total'   # family and sample name is <name>_total, as Prometheus expects of counters
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def sync(self, total, **labels):
+        """Raise the counter to `total`, a cumulative count kept elsewhere; never lowers it."""
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = max(self.values.get(key, 0), total)
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(_label_key(self.labelnames, labels), 0)
+
+    @property
+    def family(self):
+        return self.name + self.suffix
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield self.family, _format_labels(self.labelnames, key), value
+
+
+class Gauge(Counter):
+    type_name = 'gauge'
+    suffix = ''
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram:
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.series = {}   # label key -> [per-bucket counts (+Inf last), sum, count]
+
+    @property
+    def family(self):
+        return self.name
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, ([*s[0]], s[1], s[2])) for key, s in self.series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield self.name + '_bucket', _format_labels(self.labelnames, key, [('le', _format_value(bound))]), cumulative
+            yield self.name + '_sum', _format_labels(self.labelnames, key), total
+            yield self.name + '_count', _format_labels(self.labelnames, key), count
+
+
+# --------------------------------------------------
+# Registry
+# --------------------------------------------------
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _register(cls, name, documentation, labelnames, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, documentation, labelnames, **kwargs)
+        elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f'Metric {name} already registered with a different type or labels')
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def render():
+    """Every registered metric in Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines = []
+    for metric in metrics:
+        lines.append(f'# HELP {metric.family} {metric.documentation}')
+        lines.append(f'# TYPE {metric.family} {metric.type_name}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# --------------------------------------------------
+# Stage timers
+# --------------------------------------------------
+
+stage_seconds = histogram('campuseye_stage_seconds', 'Time spent in each recognition pipeline stage', ['stage'])
+
+# Callables notified with (stage, seconds) every time a stage finishes
+_observers = []
+_observers_lock = threading.Lock()
+
+
+def addObserver(observer):
+    with _observers_lock:
+        _observers.append(observer)
+
+
+def removeObserver(observer):
+    with _observers_lock:
+        if observer in _observers:
+            _observers.remove(observer)
+
+
+def observe(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+    for observer in list(_observers):
+        observer(stage, seconds)
+
+
+@contextmanager
+def timed(stage):
+    """Time a block of code as pipeline stage `stage` (detect, embed, match, log, alert, ...)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+class StageRecorder:
+    """Observer that keeps every sample, for offline percentile reports."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def __call__(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {stage: list(values) for stage, values in self.samples.items()}
+
+
+# --------------------------------------------------
+# Exporter for processes without Flask (the camera process)
+# --------------------------------------------------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def startServer(port, host='0.0.0.0'):
+    """Serve /metrics on `port` from a daemon thread. Returns the server (call shutdown() to stop)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info('Serving metrics on http://%s:%d/metrics', host, server.server_port)
+    return server
@@ -0,0 +1,68 @@
+"""
+One-shot migration: backfill the native `ts` datetime on detections that only
+have the "%d/%m/%Y %H:%M:%S" display string, then create the time-range indexes.
+
+Usage: python migrate_timestamps.py [--tz Asia/Kolkata] [--batch-size 1000] [--dry-run]
+"""
+import argparse
+from datetime import datetime
+import pytz
+from pymongo import UpdateOne
+
+import mongo_utils
+
+
+def migrate(collection, tz, batch_size=1000, dry_run=False):
+    query = {'ts': {'$exists': False}, 'timestamp': {'$type': 'string'}}
+    cursor = collection.find(query, {'timestamp': 1}, batch_size=batch_size)
+
+    updated = 0
+    unparseable = 0
+    batch = []
+
+    def flush():
+        nonlocal updated
+        if batch and not dry_run:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+        elif batch:
+            updated += len(batch)
+        batch.clear()
+
+    for doc in cursor:
+        try:
+            local = datetime.strptime(doc['timestamp'], mongo_utils.DETECTION_TIMESTAMP_FORMAT)
+        except ValueError:
+            unparseable += 1
+            continue
+        ts = tz.localize(local).astimezone(pytz.utc)
+        batch.append(UpdateOne({'_id': doc['_id'], 'ts': {'$exists': False}}, {'$set': {'ts': ts}}))
+        if len(batch) >= batch_size:
+            flush()
+            print(f'  {updated} detections migrated...')
+    flush()
+    return updated, unparseable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tz', default='Asia/Kolkata', help='time zone the display strings were written in')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    updated, unparseable = migrate(
+        mongo_utils.detections_collection,
+        pytz.timezone(args.tz),
+        batch_size=args.batch_size,
+        dry_run=args.dry_run
+    )
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {updated} detection(s), "
+          f"{unparseable} with unparseable timestamps left untouched")
+
+    if not args.dry_run:
+        mongo_utils.ensureDetectionIndexes()
+        print('Detection indexes ensured')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,158 @@
+import logging
+import threading
+import time
 import cv2
-from deepface import DeepFace
+import numpy as np
+import gallery_utils
 import mongo_utils
+import tracking_utils
+import metrics_utils
 
 MODEL = 'Facenet'
 DETECTOR = 'opencv'  # Changed to opencv for easier installation
 
-def getRepresentations(img):  # img = numpy array (BGR) or base64 encoded 
-    try:
-        obj = DeepFace.represent(
+logger = logging.getLogger(__name__)
+
+faces_detected = metrics_utils.counter('campuseye_faces_detected', 'Faces found by the detector')
+faces_embedded = metrics_utils.counter('campuseye_faces_embedded', 'Face crops run through the recognition model')
+face_matches = metrics_utils.counter('campuseye_face_matches', 'Gallery lookups by outcome', ['result'])
+
+
+class FaceModel:
+    """
+    Loads the recognition model and face detector once per process and warms
+    them up with a dummy inference, so the first real detection doesn't pay
+    for TensorFlow graph building. Safe to call from any thread.
+
+    DeepFace (and with it TensorFlow) is only imported by `load`, so importing
+    this module stays cheap for processes that never run recognition.
+    """
+
+    def __init__(self, model_name=MODEL, detector_backend=DETECTOR):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.lock = threading.Lock()
+        self.model = None
+        self.detector = None
+        self.load_time = None
+        self.warmup_time = None
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def load(self):
+        if self.loaded:
+            return self
+        with self.lock:
+            if self.loaded:  # another thread finished loading while we waited
+                return self
+            start = time.perf_counter()
+            from deepface import DeepFace
+            model = DeepFace.build_model(model_name=self.model_name)
+            self.detector = DeepFace.build_model(model_name=self.detector_backend, task='face_detector')
+            self.load_time = time.perf_counter() - start
+
+            # Run one dummy detect + embed so every lazy TF/keras path is built now
+            start = time.perf_counter()
+            dummy = np.zeros((model.input_shape[1], model.input_shape[0], 3), dtype=np.uint8)
+            faces = self._detect(dummy, enforce_detection=False)
+            self._embed(model, [f['face'] for f in faces])
+            self.warmup_time = time.perf_counter() - start
+
+            self.model = model
+            logger.info('%s loaded in %.2fs, warm-up %.2fs', self.model_name, self.load_time, self.warmup_time)
+        return self
+
+    def _detect(self, img, enforce_detection=True):
+        from deepface import DeepFace
+        return DeepFace.extract_faces(
             img_path=img,
-            model_name=MODEL,
-            detector_backend=DETECTOR,
+            detector_backend=self.detector_backend,
+            enforce_detection=enforce_detection,
+            align=True,
         )
+
+    @staticmethod
+    def _embed(model, faces):
+        """Embed aligned RGB face crops (floats in [0, 1]) with one batched forward pass."""
+        if len(faces) == 0:
+            return []
+        from deepface.modules import preprocessing
+        target_h, target_w = model.input_shape[1], model.input_shape[0]
+        # same preprocessing DeepFace.represent applies per face: RGB->BGR, pad/resize, normalize
+        batch = np.concatenate([
+            preprocessing.normalize_input(
+                img=preprocessing.resize_image(img=face[:, :, ::-1], target_size=(target_h, target_w)),
+                normalization='base',
+            )
+            for face in faces
+        ])
+        embeddings = model.model(batch, training=False)
+        return np.asarray(embeddings).tolist()
+
+    def detect(self, img):
+        """Detect and align every face in a BGR image. Raises ValueError if none are found."""
+        self.load()
+        return self._detect(img)
+
+    def embed(self, faces):
+        self.load()
+        return self._embed(self.model, faces)
+
+    def represent(self, img):
+        """
+        Detect once, then embed all crops in one batch.
+        Same output shape as DeepFace.represent: [{'embedding', 'facial_area', 'face_confidence'}].
+        """
+        faces = self.detect(img)
+        embeddings = self.embed([f['face'] for f in faces])
+        return [
+            {
+                'embedding': embedding,
+                'facial_area': f['facial_area'],
+                'face_confidence': f['confidence']
+            }
+            for f, embedding in zip(faces, embeddings)
+        ]
+
+
+face_model = FaceModel()
+face_tracker = tracking_utils.FaceTracker(mongo_utils.DISTANCE_THRESHOLD)
+
+
+def loadModel():
+    return face_model.load()
+
+
+def loadModelInBackground():
+    t = threading.Thread(target=face_model.load, name='model-warmup', daemon=True)
+    t.start()
+    return t
+
+
+def getRepresentations(img):  # img = numpy array (BGR) or base64 encoded 
+    try:
+        obj = face_model.represent(img)
         return obj
+    except ValueError as e:
+        # DeepFace's "Face could not be detected"
+        logger.debug('no face detected: %s', e)
+        return None
     except Exception as e:
-        print(f'no face detected: {str(e)}')
+        # a model that fails to import or load must not pass for "no face" on every call
+        logger.exception('Face detection failed: %s', e)
         return None
 
 def getEmbedding(img):
     try:
         obj = getRepresentations(img)
-        print("Representations:", obj)  # Debug
         if obj is None:
-            print("No face detected in image")
+            logger.info('No face detected in image')
             return None
         return obj[0]['embedding']
     except Exception as e:
-        print(f'Error generating embedding: {str(e)}')
+        logger.exception('Error generating embedding: %s', e)
         return None
 
 def drawRectangle(img, facial_area):
@@ -37,33 +163,54 @@ def drawRectangle(img, facial_area):
     img = cv2.rectangle(img, (x, y), (x + w, y + h), (255, 255, 0), 2)
     return img
 
-def findSuspects(input_img):
+def findSuspects(input_img, tracker=None):
+    tracker = tracker or face_tracker
     try:
-        input_representations = getRepresentations(input_img)
-        if input_representations is None:
-            return {'found_suspect_ids': [], 'suspects_img': input_img}
-        print('Detected', len(input_representations), 'face(s)')
-        
+        with metrics_utils.timed('detect'):
+            try:
+                faces = face_model.detect(input_img)
+            except ValueError:
+                faces = []
+        # keep tracks aging even on empty frames
+        tracks = tracker.update([f['facial_area'] for f in faces])
+        if not faces:
+            return {'found_suspect_ids': [], 'suspects_img': input_img, 'num_faces': 0}
+        faces_detected.inc(len(faces))
+        logger.debug('Detected %d face(s)', len(faces))
+
+        # only embed faces that are new or whose identity has gone stale
+        stale = [i for i, track in enumerate(tracks) if tracker.needsEmbedding(track)]
+        if stale:
+            with metrics_utils.timed('embed'):
+                embeddings = face_model.embed([faces[i]['face'] for i in stale])
+            faces_embedded.inc(len(stale))
+            # match every stale face in the frame against the gallery in one batch
+            with metrics_utils.timed('match'):
+                matches = gallery_utils.findMatches(embeddings)
+            for i, embedding, res in zip(stale, embeddings, matches):
+                if len(res) > 0:
+                    tracker.setIdentity(tracks[i], res[0]['_id'], res[0]['distance'])
+                    face_matches.inc(result='matched')
+                    gallery_utils.learnFromMatch(embedding, res)
+                else:
+                    tracker.setIdentity(tracks[i], None, None)
+                    face_matches.inc(result='unknown')
+
         found_suspect_ids = []             # stores ids of matched suspects
-        matched_rep_ids = []               # stores corresponding indexes of matched representations in input
-        rep_index = 0
-        for rep in input_representations:
-            res = mongo_utils.findMatch(rep['embedding'])
-            
-            if len(res) > 0:
+        matched_rep_ids = []               # stores corresponding indexes of matched faces in input
+        for rep_index, track in enumerate(tracks):
+            if track.student_id is not None:
                 matched_rep_ids.append(rep_index)
-                found_suspect_ids.append(res[0]['_id'])
-                
-            rep_index += 1
+                found_suspect_ids.append(track.student_id)
     
         # drawing a bounding box around found suspects
         suspects_img = input_img
         for id in matched_rep_ids:
-            facial_area = input_representations[id]['facial_area']
+            facial_area = faces[id]['facial_area']
             suspects_img = drawRectangle(suspects_img, facial_area)
               
-        return {'found_suspect_ids': found_suspect_ids, 'suspects_img': suspects_img}
+        return {'found_suspect_ids': found_suspect_ids, 'suspects_img': suspects_img, 'num_faces': len(faces)}
     
     except Exception as e:
-        print(f'Error in findSuspects: {str(e)}')
-        return {'found_suspect_ids': [], 'suspects_img': input_img}
\ No newline at end of file
+        logger.exception('Error in findSuspects: %s', e)
+        return {'found_suspect_ids': [], 'suspects_img': input_img}
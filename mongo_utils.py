@@ -1,24 +1,102 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import PyMongoError
 from dotenv import load_dotenv
+import atexit
+import logging
 import os
+import re
+import threading
+import time
+
+import metrics_utils
 
 load_dotenv()
-uri = os.getenv('MONGODB_URI')
-print("URI:", uri)  # Debug
-if not uri or not uri.startswith(('mongodb://', 'mongodb+srv://')):
-    raise ValueError("MONGODB_URI is invalid or not set. Check .env file.")
-client = MongoClient(uri)
-db = client['student_surveillance']
-students_collection = db['students']
-detections_collection = db['detections']
+
+DB_NAME = 'student_surveillance'
+
+# Connection pool, shared by every thread in the process
+MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MAX_IDLE_TIME_MS = 60000
+CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '20000'))
+WAIT_QUEUE_TIMEOUT_MS = 5000   # max wait for a free pooled connection
+
+# Write-behind buffer for detection records
+DETECTION_FLUSH_SIZE = int(os.getenv('DETECTION_FLUSH_SIZE', '100'))
+DETECTION_FLUSH_INTERVAL = float(os.getenv('DETECTION_FLUSH_INTERVAL', '2'))   # seconds
+DETECTION_MAX_BUFFER = 10000   # oldest records are dropped beyond this while Mongo is unreachable
+
+logger = logging.getLogger(__name__)
+
+detections_buffered = metrics_utils.gauge('campuseye_detections_buffered', 'Detection records waiting to be written')
+detection_writes = metrics_utils.counter('campuseye_detection_writes', 'Detection records by write outcome', ['outcome'])
+
+# --------------------------------------------------
+# Connection
+#
+# Nothing connects at import time: the client is built on first use of
+# `client`, `db` or a collection, and pymongo only opens sockets on the
+# first operation.
+# --------------------------------------------------
+
+_client = None
+_client_lock = threading.Lock()
+
+def _connect():
+    uri = os.getenv('MONGODB_URI')
+    if not uri or not uri.startswith(('mongodb://', 'mongodb+srv://', 'mongomock://')):
+        raise ValueError("MONGODB_URI is invalid or not set. Check .env file.")
+    if uri.startswith('mongomock://'):
+        # in-memory fake for replay/benchmark runs; needs `pip install mongomock`
+        import mongomock
+        return mongomock.MongoClient()
+    return MongoClient(
+        uri,
+        connect=False,
+        appname='campuseye',
+        maxPoolSize=MAX_POOL_SIZE,
+        minPoolSize=MIN_POOL_SIZE,
+        maxIdleTimeMS=MAX_IDLE_TIME_MS,
+        connectTimeoutMS=CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+        retryWrites=True
+    )
+
+def getClient():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _connect()
+    return _client
+
+def getDatabase():
+    return getClient()[DB_NAME]
+
+_LAZY_ATTRIBUTES = {
+    'client': getClient,
+    'db': getDatabase,
+    'students_collection': lambda: getDatabase()['students'],
+    'detections_collection': lambda: getDatabase()['detections']
+}
+
+def __getattr__(name):
+    # mongo_utils.students_collection etc. keep working, resolved on first access
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 DISTANCE_THRESHOLD = 10
 
 def deleteStudent(student_id):
-    students_collection.delete_one({'studentId': student_id})
+    getDatabase()['students'].delete_one({'studentId': student_id})
 
 def getStudentDetails(student_id):
-    query = students_collection.find_one(
+    query = getDatabase()['students'].find_one(
         {'studentId': student_id},
         {
             'name': 1,
@@ -31,7 +109,7 @@ def getStudentDetails(student_id):
     return query
 
 def getSuspectsDetails(suspect_ids):
-    query = students_collection.find(
+    query = getDatabase()['students'].find(
         {'studentId': {"$in": suspect_ids}},
         {
             'name': 1,
@@ -43,50 +121,228 @@ def getSuspectsDetails(suspect_ids):
     )
     return list(query)
 
-def findMatch(target_embedding):
-    query = students_collection.aggregate([
-        {
-            "$addFields": {
-                "target_embedding": target_embedding
-            }
-        }, {"$unwind": {"path": "$embedding", "includeArrayIndex": "embedding_index"}},
-        {"$unwind": {"path": "$target_embedding", "includeArrayIndex": "target_index"}},
-        {
-            "$project": {
-                "studentId": 1,
-                "embedding": 1,
-                "target_embedding": 1,
-                "compare": {
-                    "$cmp": ['$embedding_index', '$target_index']
-                }
-            }
-        }, {"$match": {"compare": 0}},
-        {
-            "$group": {
-                "_id": "$studentId",
-                "distance": {
-                    "$sum": {
-                        "$pow": [{
-                            "$subtract": ['$embedding', '$target_embedding']
-                        }, 2]
-                    }
-                }
-            }
-        },
-        {
-            "$project": {
-                "_id": 1,
-                "distance": {"$sqrt": "$distance"}
-            }
-        },
-        {
-            "$project": {
-                "_id": 1, "distance": 1, "cond": {"$lte": ["$distance", DISTANCE_THRESHOLD]}
-            }
-        }, {"$match": {"cond": True}}, {"$sort": {"distance": 1}}, {"$limit": DISTANCE_THRESHOLD}
-    ])
+STUDENT_ID_INDEX = 'studentId_unique'
+BACKFILL_BATCH_SIZE = 1000
+_student_id_unique = False   # set once ensureStudentIndexes has confirmed the unique index
 
-    return list(query)
+def ensureStudentIndexes(collection=None):
+    """
+    Create the unique studentId index enrollment relies on to reject
+    duplicates. Raises if it can't be created (e.g. duplicates already exist);
+    the old non-unique index is only dropped once the unique one is in place.
+    """
+    global _student_id_unique
+    students = collection is None
+    collection = collection if collection is not None else getDatabase()['students']
+    # the partial filter lets it coexist with the old non-unique studentId_1 on the same key
+    collection.create_index(
+        [('studentId', ASCENDING)],
+        name=STUDENT_ID_INDEX,
+        unique=True,
+        partialFilterExpression={'studentId': {'$exists': True}}
+    )
+    if 'studentId_1' in collection.index_information():
+        collection.drop_index('studentId_1')
+    if students:
+        _student_id_unique = True
+    collection.create_index([('name', ASCENDING)])
+    collection.create_index([('nameLower', ASCENDING)])
+    collection.create_index([('studentIdLower', ASCENDING)])
+    backfillSearchKeys(collection)
+
+def searchKeys(name, student_id):
+    """
+    Lower-cased name and studentId stored on every student. listStudents
+    prefix-matches them case-sensitively, which is an index range; a
+    case-insensitive regex would scan the whole index.
+    """
+    return {'nameLower': (name or '').lower(), 'studentIdLower': (student_id or '').lower()}
+
+def backfillSearchKeys(collection):
+    """Add searchKeys to students enrolled before they existed. Returns the number updated."""
+    updated = 0
+    batch = []
+    for student in collection.find({'nameLower': {'$exists': False}}, {'name': 1, 'studentId': 1}):
+        batch.append(UpdateOne({'_id': student['_id']},
+                               {'$set': searchKeys(student.get('name'), student.get('studentId'))}))
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    if updated:
+        logger.info('Added search keys to %d student(s)', updated)
+    return updated
+
+def studentIdIsUnique():
+    """True once the unique studentId index is known to exist on the students collection."""
+    return _student_id_unique
+
+def listStudents(page=1, per_page=25, search=None):
+    """One page of students (without embeddings or templates) sorted by studentId, plus the total match count."""
+    query = {}
+    if search:
+        prefix = {'$regex': '^' + re.escape(search.lower())}
+        query = {'$or': [{'nameLower': prefix}, {'studentIdLower': prefix}]}
+
+    students = getDatabase()['students']
+    total = students.count_documents(query)
+    cursor = students.find(query, {'_id': 0, 'embedding': 0, 'templates': 0, 'liveTemplates': 0}) \
+        .sort('studentId', ASCENDING).skip((page - 1) * per_page).limit(per_page)
+    return list(cursor), total
+
+class DetectionWriter:
+    """
+    Write-behind buffer for detection records. `add` only appends; a
+    background thread writes with one unordered insert_many once
+    `flush_size` records are waiting or `flush_interval` seconds have passed.
+    Records that fail to write stay buffered for the next flush.
+    """
+
+    def __init__(self, collection=None, flush_size=DETECTION_FLUSH_SIZE,
+                 flush_interval=DETECTION_FLUSH_INTERVAL, max_buffer=DETECTION_MAX_BUFFER):
+        self._collection = collection
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()   # one insert_many at a time
+        self.buffer = []
+        self.running = False
+        self.failing = False   # after a failed write, wait a full interval before retrying
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def collection(self):
+        return self._collection if self._collection is not None else getDatabase()['detections']
+
+    def add(self, records):
+        with self.cond:
+            self.buffer.extend(records)
+            overflow = len(self.buffer) - self.max_buffer
+            if overflow > 0:
+                del self.buffer[:overflow]
+                self.dropped += overflow
+                detection_writes.inc(overflow, outcome='dropped')
+            detections_buffered.set(len(self.buffer))
+            if not self.running:
+                self._start()
+            if len(self.buffer) >= self.flush_size:
+                self.cond.notify()
+
+    def _start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='detection-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                deadline = time.monotonic() + self.flush_interval
+                while self.running and (self.failing or len(self.buffer) < self.flush_size):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                running = self.running
+            self.flush()
+            if not running:
+                return
+
+    def flush(self):
+        """Write everything buffered now. Returns the number of records written."""
+        with self.flush_lock:
+            with self.cond:
+                batch, self.buffer = self.buffer, []
+            if not batch:
+                return 0
+            try:
+                with metrics_utils.timed('mongo_write'):
+                    self.collection.insert_many(batch, ordered=False)
+            except PyMongoError as e:
+                details = getattr(e, 'details', None) or {}
+                if details:
+                    # BulkWriteError: keep the rejected records, except duplicates of
+                    # ones a previous, seemingly failed attempt already wrote
+                    written = details.get('nInserted', 0)
+                    failed = [batch[err['index']] for err in details.get('writeErrors', [])
+                              if err.get('code') != 11000]
+                else:
+                    written = 0
+                    failed = batch   # nothing reached the server: keep the whole batch
+                logger.warning('Detection write failed (%s); %d record(s) kept for retry', e, len(failed))
+                detection_writes.inc(len(failed), outcome='retry')
+                with self.cond:
+                    self.buffer[:0] = failed
+                    self.failing = bool(failed)
+            else:
+                written = len(batch)
+                self.failing = False
+            self.written += written
+            detection_writes.inc(written, outcome='written')
+            with self.cond:
+                detections_buffered.set(len(self.buffer))
+            return written
+
+    def close(self, timeout=10):
+        """Stop the writer thread after a final flush."""
+        with self.cond:
+            if not self.running:
+                return
+            self.running = False
+            self.cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def stats(self):
+        with self.cond:
+            return {'buffered': len(self.buffer), 'written': self.written, 'dropped': self.dropped}
+
+detection_writer = DetectionWriter()
+atexit.register(detection_writer.close)
 
 def store_detection_records(records):
-    detections_collection.insert_many(records)
\ No newline at end of file
+    detection_writer.add(records)
+
+def flushDetections():
+    return detection_writer.flush()
+
+DETECTION_REPORT_FIELDS = ['name', 'studentId', 'branch', 'timestamp', 'photoUrl']
+DETECTION_TIMESTAMP_FORMAT = '%d/%m/%Y %H:%M:%S'  # display string; `ts` holds the UTC datetime
+
+def ensureDetectionIndexes(collection=None):
+    collection = collection if collection is not None else getDatabase()['detections']
+    # "last N detections for X" and per-student date windows are index-only
+    collection.create_index([('studentId', ASCENDING), ('ts', DESCENDING)])
+    # _id breaks ts ties so the recent-detections listing is stable and still index-only
+    collection.create_index([('name', ASCENDING), ('ts', DESCENDING), ('_id', DESCENDING)])
+    if 'name_1_ts_-1' in collection.index_information():
+        collection.drop_index('name_1_ts_-1')   # a prefix of the index above
+    collection.create_index([('ts', ASCENDING)])
+
+def buildDetectionQuery(start=None, end=None, branch=None, student_id=None):
+    """
+    Mongo filter for detections. `start`/`end` are datetimes (end exclusive)
+    matched against the indexed `ts` field.
+    """
+    query = {}
+    if branch:
+        query['branch'] = branch
+    if student_id:
+        query['studentId'] = student_id
+
+    ts = {}
+    if start is not None:
+        ts['$gte'] = start
+    if end is not None:
+        ts['$lt'] = end
+    if ts:
+        query['ts'] = ts
+    return query
+
+def iterDetections(query, batch_size=1000):
+    projection = {field: 1 for field in DETECTION_REPORT_FIELDS}
+    projection['_id'] = 0
+    return getDatabase()['detections'].find(query, projection, batch_size=batch_size).sort('ts', ASCENDING)
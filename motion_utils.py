@@ -0,0 +1,92 @@
+import threading
+import time
+import cv2
+
+GATE_WIDTH = 160               # frames are downscaled to this width before differencing
+PIXEL_DIFF_THRESHOLD = 25      # grey-level change that counts as a changed pixel
+MIN_CHANGED_FRACTION = 0.01    # fraction of changed pixels that counts as motion
+BACKGROUND_ALPHA = 0.1         # running-average learning rate for the background
+FACE_RECHECK_INTERVAL = 30     # seconds; re-check a still scene that last had faces in it
+
+
+class MotionGate:
+    """
+    Cheap pre-filter in front of face recognition.
+
+    Keeps a downscaled running-average background and only lets a frame
+    through when enough of it has changed. An optional Haar cascade check
+    additionally requires something face-like to be in the frame.
+    Still scenes that last contained faces are re-checked every
+    FACE_RECHECK_INTERVAL seconds so stationary students keep being logged.
+    """
+
+    def __init__(self, face_check=False):
+        self.lock = threading.Lock()
+        self.background = None
+        self.face_cascade = None
+        if face_check:
+            self.face_cascade = cv2.CascadeClassifier(
+                cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+            )
+        self.faces_present = False
+        self.last_passed = 0.0
+
+        self.checked = 0
+        self.passed = 0
+        self.gated_no_motion = 0
+        self.gated_no_face = 0
+
+    def _prepare(self, frame):
+        h, w = frame.shape[:2]
+        scale = GATE_WIDTH / float(w)
+        small = cv2.resize(frame, (GATE_WIDTH, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def _has_motion(self, gray):
+        if self.background is None:
+            self.background = gray.astype('float32')
+            return True
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        changed = cv2.countNonZero(cv2.threshold(diff, PIXEL_DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)[1])
+        cv2.accumulateWeighted(gray, self.background, BACKGROUND_ALPHA)
+        return changed >= MIN_CHANGED_FRACTION * gray.size
+
+    def _has_face(self, gray):
+        if self.face_cascade is None:
+            return True
+        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=3, minSize=(12, 12))
+        return len(faces) > 0
+
+    def check(self, frame, now=None):
+        """Return True if the frame is worth sending to face recognition."""
+        now = time.monotonic() if now is None else now
+        gray = self._prepare(frame)
+        with self.lock:
+            self.checked += 1
+            if not self._has_motion(gray):
+                recheck = self.faces_present and now - self.last_passed >= FACE_RECHECK_INTERVAL
+                if not recheck:
+                    self.gated_no_motion += 1
+                    return False
+            if not self._has_face(gray):
+                self.gated_no_face += 1
+                return False
+            self.passed += 1
+            self.last_passed = now
+            return True
+
+    def markFaces(self, num_faces):
+        """Tell the gate whether the last recognised frame contained faces."""
+        with self.lock:
+            self.faces_present = num_faces > 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'checked': self.checked,
+                'passed': self.passed,
+                'gated_no_motion': self.gated_no_motion,
+                'gated_no_face': self.gated_no_face,
+                'gated_out': self.gated_no_motion + self.gated_no_face
+            }
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+NOTIFY_BACKEND = os.getenv('NOTIFY_BACKEND', 'sqlite')     # 'memory', 'sqlite' or 'mongo'
+NOTIFY_DB = os.getenv('NOTIFY_DB', 'notifications.db')      # sqlite backend only
+NOTIFY_TTL = float(os.getenv('NOTIFY_TTL', '0')) or None    # seconds; None = until the daily reset
+NOTIFY_DAILY_RESET = os.getenv('NOTIFY_DAILY_RESET', '1') == '1'
+MAX_ENTRIES = 10000     # memory backend bound; expired entries go first, then the oldest
+PURGE_EVERY = 500       # sqlite backend: delete expired rows every N claims
+
+
+# --------------------------------------------------
+# Backends
+#
+# Each one stores student id -> expiry (epoch seconds) and implements
+# claim(key, now, expires_at): atomically record the claim and return True
+# unless an unexpired one already exists.
+# --------------------------------------------------
+
+class MemoryNotificationStore:
+    name = 'memory'
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> expires_at, in claim order
+
+    def claim(self, key, now, expires_at):
+        with self.lock:
+            current = self.entries.get(key)
+            if current is not None and current > now:
+                return False
+            self.entries[key] = expires_at
+            self.entries.move_to_end(key)
+            # expiries only grow with claim time, so expired entries sit at the front
+            while self.entries and (next(iter(self.entries.values())) <= now or len(self.entries) > self.max_entries):
+                self.entries.popitem(last=False)
+            return True
+
+    def release(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def size(self):
+        with self.lock:
+            return len(self.entries)
+
+
+class SQLiteNotificationStore:
+    """
+    A local file shared by every process on the machine. WAL mode lets
+    readers and the single writer run concurrently; the conditional upsert
+    makes each claim one atomic statement.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path=NOTIFY_DB, purge_every=PURGE_EVERY):
+        self.path = path
+        self.purge_every = purge_every
+        self.lock = threading.Lock()
+        self.claims = 0
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS notifications ('
+            'student_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, claimed_at REAL NOT NULL)'
+        )
+
+    def claim(self, key, now, expires_at):
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT INTO notifications (student_id, expires_at, claimed_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(student_id) DO UPDATE SET expires_at = excluded.expires_at, '
+                'claimed_at = excluded.claimed_at WHERE notifications.expires_at <= ?',
+                (key, expires_at, now, now)
+            )
+            claimed = cursor.rowcount == 1
+            self.claims += 1
+            if self.claims % self.purge_every == 0:
+                self.conn.execute('DELETE FROM notifications WHERE expires_at <= ?', (now,))
+            return claimed
+
+    def release(self, key):
+        with self.lock:
+            self.conn.execute('DELETE FROM notifications WHERE student_id = ?', (key,))
+
+    def size(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM notifications').fetchone()[0]
+
+
+class MongoNotificationStore:
+    """
+    One document per student with a unique studentId index, shared by every
+    process and machine. A TTL index on expiresAt lets Mongo drop old claims.
+    """
+    name = 'mongo'
+
+    def __init__(self, collection=None):
+        if collection is None:
+            import mongo_utils
+            collection = mongo_utils.db['notifications']
+        self.collection = collection
+        self.collection.create_index('studentId', unique=True)
+        self.collection.create_index('expiresAt', expireAfterSeconds=0)
+
+    def claim(self, key, now, expires_at):
+        from pymongo.errors import DuplicateKeyError
+        now_dt = datetime.fromtimestamp(now, timezone.utc)
+        try:
+            # matches only an expired claim; with no claim at all the upsert inserts one,
+            # and with a live claim the insert hits the unique index
+            self.collection.update_one(
+                {'studentId': key, 'expiresAt': {'$lte': now_dt}},
+                {'$set': {'expiresAt': datetime.fromtimestamp(expires_at, timezone.utc), 'claimedAt': now_dt}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def release(self, key):
+        self.collection.delete_one({'studentId': key})
+
+    def size(self):
+        return self.collection.count_documents({})
+
+
+BACKENDS = {
+    MemoryNotificationStore.name: MemoryNotificationStore,
+    SQLiteNotificationStore.name: SQLiteNotificationStore,
+    MongoNotificationStore.name: MongoNotificationStore
+}
+
+
+def getBackend(backend=None, **kwargs):
+    backend = backend or NOTIFY_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown notification backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+    return BACKENDS[backend](**kwargs)
+
+
+# --------------------------------------------------
+# Notification state
+# --------------------------------------------------
+
+class NotificationState:
+    """
+    Decides whether a detection should raise an alert.
+
+    `claim(student_id)` is an atomic check-and-set: exactly one caller, in
+    any thread or process sharing the backend, gets True until the claim
+    expires. Claims expire after `ttl` seconds and/or at local midnight when
+    `daily_reset` is on, so each student alerts at most once per window.
+    """
+
+    def __init__(self, store=None, ttl=NOTIFY_TTL, daily_reset=NOTIFY_DAILY_RESET, tz=None):
+        if ttl is None and not daily_reset:
+            raise ValueError('Set a ttl, daily_reset, or both')
+        self.store = store if store is not None else getBackend()
+        self.ttl = ttl
+        self.daily_reset = daily_reset
+        self.tz = tz
+
+    def expiry(self, now):
+        expires_at = float('inf')
+        if self.ttl is not None:
+            expires_at = now + self.ttl
+        if self.daily_reset:
+            local = datetime.fromtimestamp(now, self.tz)
+            midnight = datetime.combine(local.date() + timedelta(days=1), datetime.min.time())
+            midnight = self.tz.localize(midnight) if hasattr(self.tz, 'localize') else midnight.replace(tzinfo=local.tzinfo)
+            expires_at = min(expires_at, midnight.timestamp())
+        return expires_at
+
+    def claim(self, student_id, now=None):
+        """True if the caller should alert for this student now."""
+        now = time.time() if now is None else now
+        return self.store.claim(str(student_id), now, self.expiry(now))
+
+    def release(self, student_id):
+        """Forget a claim (e.g. the alert could not be delivered) so the next detection alerts again."""
+        self.store.release(str(student_id))
+
+    def size(self):
+        return self.store.size()
@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import metrics_utils
+
+NUM_WORKERS = 2
+QUEUE_SIZE = 2  # frames waiting for a worker; older ones are dropped first
+
+logger = logging.getLogger(__name__)
+
+frames_dropped = metrics_utils.counter('campuseye_pipeline_frames_dropped', 'Queued frames discarded for newer ones')
+queue_depth = metrics_utils.gauge('campuseye_pipeline_queue_depth', 'Frames waiting for a recognition worker')
+
+
+class StageTimer:
+    """Running latency stats for one pipeline stage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            self.max = max(self.max, seconds)
+
+    def stats(self):
+        with self.lock:
+            avg = self.total / self.count if self.count else 0.0
+            return {'count': self.count, 'avg': avg, 'max': self.max, 'last': self.last}
+
+
+class RecognitionPipeline:
+    """
+    Fixed pool of worker threads fed by a bounded frame queue.
+
+    `submit` never blocks: when the queue is full the oldest waiting frame is
+    dropped so workers always pick up the most recent frames.
+    """
+
+    def __init__(self, handler, num_workers=NUM_WORKERS, queue_size=QUEUE_SIZE):
+        self.handler = handler
+        self.num_workers = num_workers
+        self.queue = deque(maxlen=queue_size)
+        self.cond = threading.Condition()
+        self.running = False
+        self.workers = []
+
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.busy = 0
+        self.timers = {
+            'queue_wait': StageTimer(),
+            'process': StageTimer()
+        }
+
+    def start(self):
+        self.running = True
+        for i in range(self.num_workers):
+            t = threading.Thread(target=self._worker, name=f'recognition-{i}', daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def stop(self, timeout=5):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for t in self.workers:
+            t.join(timeout=timeout)
+        self.workers = []
+
+    def waitIdle(self, timeout=None):
+        """Block until the queue is empty and no worker is busy. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.cond:
+                if not self.queue and self.busy == 0:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def submit(self, frame, *args):
+        """Queue a frame for recognition. Returns False if an older frame had to be dropped."""
+        with self.cond:
+            self.submitted += 1
+            dropped = len(self.queue) == self.queue.maxlen
+            if dropped:
+                self.dropped += 1
+                frames_dropped.inc()
+            # deque(maxlen) discards the oldest entry on overflow
+            self.queue.append((time.perf_counter(), frame, args))
+            queue_depth.set(len(self.queue))
+            self.cond.notify()
+        return not dropped
+
+    def depth(self):
+        with self.cond:
+            return len(self.queue)
+
+    def stats(self):
+        with self.cond:
+            stats = {
+                'queue_depth': len(self.queue),
+                'queue_size': self.queue.maxlen,
+                'workers': self.num_workers,
+                'busy_workers': self.busy,
+                'submitted': self.submitted,
+                'dropped': self.dropped,
+                'processed': self.processed
+            }
+        for name, timer in self.timers.items():
+            stats[name] = timer.stats()
+        return stats
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                queued_at, frame, args = self.queue.popleft()
+                self.busy += 1
+                queue_depth.set(len(self.queue))
+
+            started = time.perf_counter()
+            self.timers['queue_wait'].record(started - queued_at)
+            metrics_utils.observe('queue_wait', started - queued_at)
+            try:
+                self.handler(frame, *args)
+            except Exception as e:
+                logger.exception('Error in recognition worker: %s', e)
+            finally:
+                self.timers['process'].record(time.perf_counter() - started)
+                with self.cond:
+                    self.busy -= 1
+                    self.processed += 1
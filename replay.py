@@ -0,0 +1,243 @@
+"""
+Replay a folder of images or a video file through the full recognition path.
+
+Runs headless against an in-memory Mongo (mongomock) and a local stub email
+endpoint, so no camera, database or network is needed. Every frame goes
+through main.check_frame (detect, embed, match, CSV log, alert queue, Mongo
+write) and the run ends with frames/sec, per-stage p50/p90/p99 and peak RSS.
+
+Students to recognise can be seeded from --students, a folder of photos named
+<studentId>_<name>.jpg (the name may contain underscores).
+
+Usage: python replay.py frames/ --students gallery/ [--workers 2] [--json report.json]
+       python replay.py hallway.mp4 --students gallery/ --sample-every 30
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+STAGES = ['detect', 'embed', 'match', 'log', 'mongo_write', 'alert']
+
+
+class _StubEmailHandler(BaseHTTPRequestHandler):
+    """Accepts anything POSTed to it, like a healthy /send-email."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{"success": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_email_server():
+    server = HTTPServer(('127.0.0.1', 0), _StubEmailHandler)
+    threading.Thread(target=server.serve_forever, name='stub-email', daemon=True).start()
+    return server
+
+
+def iter_frames(source, sample_every):
+    """Yield (label, BGR frame) from an image folder or every Nth frame of a video file."""
+    import cv2
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is None:
+                print(f"Skipping unreadable image {name}")
+                continue
+            yield name, frame
+        return
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise SystemExit(f"Could not open {source}")
+    index = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            if index % sample_every == 0:
+                yield f'frame {index}', frame
+            index += 1
+    finally:
+        cap.release()
+
+
+def seed_students(students_dir):
+    """Embed <studentId>_<name>.jpg photos and insert them into the (mock) students collection."""
+    import cv2
+    import model_utils
+    import mongo_utils
+
+    docs = []
+    for name in sorted(os.listdir(students_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in IMAGE_EXTENSIONS or '_' not in stem:
+            continue
+        student_id, student_name = stem.split('_', 1)
+        img = cv2.imread(os.path.join(students_dir, name))
+        embedding = model_utils.getEmbedding(img) if img is not None else None
+        if embedding is None:
+            print(f"Skipping {name}: clear face not detected")
+            continue
+        docs.append({
+            'name': student_name.replace('_', ' '),
+            'studentId': student_id,
+            'branch': 'REPLAY',
+            'embedding': embedding,
+            'photoUrl': 'file://' + os.path.abspath(os.path.join(students_dir, name)),
+            'updatedAt': datetime.utcnow(),
+            **mongo_utils.searchKeys(student_name.replace('_', ' '), student_id)
+        })
+    if docs:
+        mongo_utils.students_collection.insert_many(docs)
+    return len(docs)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def build_report(frames, elapsed, samples, extra):
+    report = {
+        'frames': frames,
+        'seconds': round(elapsed, 3),
+        'fps': round(frames / elapsed, 2) if elapsed else 0.0,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages': {}
+    }
+    for stage in STAGES + sorted(set(samples) - set(STAGES)):
+        values = sorted(samples.get(stage, []))
+        report['stages'][stage] = {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p90_ms': round(percentile(values, 90) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2)
+        }
+    report.update(extra)
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['frames']} frames in {report['seconds']}s -> {report['fps']} frames/sec, "
+          f"peak RSS {report['peak_rss_mb']} MB")
+    print(f"{'stage':>12} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for stage, s in report['stages'].items():
+        print(f"{stage:>12} {s['count']:>7} {s['p50_ms']:>9} {s['p90_ms']:>9} {s['p99_ms']:>9}")
+    print(f"alerts: {report['alerts']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('source', help='folder of images or a video file')
+    parser.add_argument('--students', help='folder of <studentId>_<name>.jpg photos to enroll first')
+    parser.add_argument('--workers', type=int, default=2, help='frames processed concurrently')
+    parser.add_argument('--sample-every', type=int, default=1, help='video only: process every Nth frame')
+    parser.add_argument('--output-dir', help='attendance CSV, event log and alert spool go here (default: temp dir)')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix='campuseye-replay-')
+    os.makedirs(output_dir, exist_ok=True)
+    stub = start_stub_email_server()
+
+    # Must be set before mongo_utils / alert_utils are imported: both read them at import time
+    os.environ['MONGODB_URI'] = os.getenv('REPLAY_MONGODB_URI', 'mongomock://')
+    os.environ['ALERT_EMAIL_ENDPOINT'] = f'http://127.0.0.1:{stub.server_port}/send-email'
+    os.environ['ALERT_SPOOL_DIR'] = os.path.join(output_dir, 'alert_spool')
+    os.environ['NOTIFY_BACKEND'] = 'memory'
+    # never read (or overwrite) the production gallery snapshot
+    os.environ['GALLERY_SNAPSHOT'] = os.path.join(output_dir, 'gallery_snapshot')
+    os.environ.pop('BOT_TOKEN', None)
+
+    import main as camera_main
+    import model_utils
+    import gallery_utils
+    import metrics_utils
+    import mongo_utils
+    import tracking_utils
+
+    metrics_utils.setupLogging()
+    camera_main.init_services(
+        attendance_file=os.path.join(output_dir, 'attendance.csv'),
+        event_log=os.path.join(output_dir, 'attendance.events.csv'),
+        spool_dir=os.environ['ALERT_SPOOL_DIR']
+    )
+    model_utils.loadModel()
+    if args.students:
+        print(f"Enrolled {seed_students(args.students)} student(s) from {args.students}")
+    gallery_utils.startSync()
+
+    recorder = metrics_utils.StageRecorder()
+    metrics_utils.addObserver(recorder)
+
+    # Replay has its own tracker instead of the process-wide one. Images in a
+    # folder are unrelated, so each gets a fresh tracker and is always embedded;
+    # a video's frames continue tracks like a camera's would.
+    is_folder = os.path.isdir(args.source)
+    video_tracker = tracking_utils.FaceTracker(mongo_utils.DISTANCE_THRESHOLD)
+
+    frames = 0
+    start = time.perf_counter()
+    # Bounded in-flight window: never decode more frames than the workers can take
+    semaphore = threading.BoundedSemaphore(args.workers * 2)
+    with ThreadPoolExecutor(args.workers) as pool:
+        for label, frame in iter_frames(args.source, args.sample_every):
+            semaphore.acquire()
+            tracker = tracking_utils.FaceTracker(mongo_utils.DISTANCE_THRESHOLD) if is_folder else video_tracker
+            future = pool.submit(camera_main.check_frame, frame, tracker=tracker)
+            future.add_done_callback(lambda _: semaphore.release())
+            frames += 1
+    elapsed = time.perf_counter() - start
+
+    camera_main.alert_dispatcher.waitIdle(timeout=30)
+    mongo_utils.flushDetections()
+    metrics_utils.removeObserver(recorder)
+    alerts = camera_main.alert_dispatcher.stats()
+    camera_main.shutdown_services()
+    gallery_utils.gallery_sync.stop()
+    stub.shutdown()
+
+    report = build_report(frames, elapsed, recorder.snapshot(), {
+        'workers': args.workers,
+        'students': gallery_utils.gallery.size(),
+        'alerts': alerts,
+        'output_dir': output_dir
+    })
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import bisect
+import threading
+import time
+from datetime import datetime
+
+DAY_SECONDS = 24 * 60 * 60
+
+IDLE_INTERVAL = 4.0      # seconds between samples while no faces are around (the old WAIT_DURATION)
+ACTIVE_INTERVAL = 1.0    # seconds between samples while faces are in view
+ACTIVE_HOLD = 10.0       # keep the fast rate this long after the last frame with faces
+MAX_BACKOFF = 8          # slowest rate under backlog is interval * MAX_BACKOFF
+FPS_WINDOW = 2           # seconds over which capture FPS is measured
+
+
+def _seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1e6
+
+
+class SlotSchedule:
+    """
+    Detection time slots, precomputed into sorted, merged intervals.
+
+    Slots are (start, end) datetime.time pairs with the end inclusive, as in
+    main.TIME_SLOTS. Overlapping slots are merged and a slot whose end is
+    before its start wraps past midnight. `isActive` remembers when the
+    current answer next changes, so the per-frame check is one comparison;
+    a bisect only runs when a slot boundary (or midnight) is crossed.
+    """
+
+    def __init__(self, slots, tz=None):
+        self.tz = tz
+        intervals = []
+        for start, end in slots:
+            start, end = _seconds(start), _seconds(end)
+            if end >= start:
+                intervals.append((start, end))
+            else:  # crosses midnight
+                intervals.append((start, DAY_SECONDS))
+                intervals.append((0.0, end))
+        intervals.sort()
+
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.intervals = merged
+        self.starts = [start for start, _ in merged]
+
+        self.lock = threading.Lock()
+        self._active = False
+        self._since = float('inf')    # the cached answer holds for epoch seconds in [_since, _until)
+        self._until = float('-inf')
+
+    def _lookup(self, now):
+        local = datetime.fromtimestamp(now, self.tz)
+        day_start = now - _seconds(local.time())
+        offset = now - day_start
+
+        i = bisect.bisect_right(self.starts, offset) - 1
+        if i >= 0 and offset <= self.intervals[i][1]:
+            # inclusive end: still active at exactly `end`
+            return True, day_start + self.intervals[i][1] + 1e-6
+        next_start = self.starts[i + 1] if i + 1 < len(self.starts) else DAY_SECONDS
+        return False, day_start + next_start
+
+    def isActive(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if not self._since <= now < self._until:
+                self._active, until = self._lookup(now)
+                # re-evaluate at local midnight too, so DST shifts and wrap-around slots stay exact
+                local = datetime.fromtimestamp(now, self.tz)
+                midnight = now - _seconds(local.time()) + DAY_SECONDS
+                self._since, self._until = now, min(until, midnight)
+            return self._active
+
+    def describe(self):
+        def fmt(s):
+            s = min(int(s), DAY_SECONDS - 1)
+            return f'{s // 3600:02d}:{s % 3600 // 60:02d}'
+        return ', '.join(f'{fmt(start)}-{fmt(end)}' for start, end in self.intervals)
+
+
+class AdaptiveSampler:
+    """
+    Decides which captured frames go to recognition, by time instead of frame count.
+
+    Measures the real capture FPS, samples every ACTIVE_INTERVAL seconds while
+    recent frames had faces and every IDLE_INTERVAL seconds otherwise, and
+    stretches the interval (up to MAX_BACKOFF times) while the recognizer has
+    a backlog, relaxing again once the queue drains.
+    """
+
+    def __init__(self, idle_interval=IDLE_INTERVAL, active_interval=ACTIVE_INTERVAL,
+                 active_hold=ACTIVE_HOLD, max_backoff=MAX_BACKOFF, backlog=None):
+        self.idle_interval = idle_interval
+        self.active_interval = active_interval
+        self.active_hold = active_hold
+        self.max_backoff = max_backoff
+        self.backlog = backlog       # callable: frames waiting for recognition right now
+
+        self.lock = threading.Lock()
+        self.backoff = 1
+        self.last_sample = None
+        self.last_faces = None
+        self.fps = 0.0
+        self._window_start = None
+        self._window_frames = 0
+
+        self.frames = 0
+        self.sampled = 0
+
+    def _interval(self, now):
+        active = self.last_faces is not None and now - self.last_faces <= self.active_hold
+        return (self.active_interval if active else self.idle_interval) * self.backoff
+
+    def interval(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return self._interval(now)
+
+    def due(self, now=None):
+        """Count a captured frame; True if it should be sampled."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.frames += 1
+            if self._window_start is None:
+                self._window_start = now
+            self._window_frames += 1
+            if now - self._window_start >= FPS_WINDOW:
+                self.fps = self._window_frames / (now - self._window_start)
+                self._window_start, self._window_frames = now, 0
+
+            if self.last_sample is not None and now - self.last_sample < self._interval(now):
+                return False
+
+        # ask for the backlog outside our lock; it takes the pipeline's
+        waiting = self.backlog() if self.backlog is not None else 0
+        with self.lock:
+            if waiting:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+            elif self.backoff > 1:
+                self.backoff //= 2
+            self.last_sample = now
+            self.sampled += 1
+            return True
+
+    def markFaces(self, num_faces, now=None):
+        """Called with the face count of each recognised frame."""
+        if num_faces > 0:
+            with self.lock:
+                self.last_faces = time.monotonic() if now is None else now
+
+    def stats(self):
+        with self.lock:
+            now = self.last_sample if self.last_sample is not None else time.monotonic()
+            return {
+                'fps': round(self.fps, 1),
+                'interval': round(self._interval(now), 2),
+                'backoff': self.backoff,
+                'frames': self.frames,
+                'sampled': self.sampled
+            }
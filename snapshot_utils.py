@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+import numpy as np
+
+EMBEDDING_DIM = 128
+SNAPSHOT_FORMAT = 2   # 2: several templates per student
+SNAPSHOT_DIR = os.getenv('GALLERY_SNAPSHOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gallery_snapshot'))
+SNAPSHOT_DTYPES = ('float32', 'float16', 'int8')
+MANIFEST_NAME = 'manifest.json'
+# the delta query starts this far before the snapshot's newest updatedAt, so a
+# write from a host with a slightly slow clock during the snapshot isn't missed
+CLOCK_SKEW = timedelta(seconds=60)
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PROJECTION = {
+    '_id': 1,
+    'studentId': 1,
+    'name': 1,
+    'branch': 1,
+    'photoUrl': 1,
+    'embedding': 1,
+    'templates': 1,
+    'liveTemplates': 1,
+    'updatedAt': 1
+}
+
+
+def studentTemplates(student):
+    """
+    Every usable template of a student document: the enrollment `templates`
+    (or the single legacy `embedding`) followed by any `liveTemplates`
+    learned from confident live matches.
+    """
+    templates = student.get('templates') or []
+    if not templates and student.get('embedding') is not None:
+        templates = [student['embedding']]
+    templates = list(templates) + list(student.get('liveTemplates') or [])
+    return [t for t in templates if t is not None and len(t) == EMBEDDING_DIM]
+
+
+class Snapshot:
+    """
+    A loaded snapshot: float32 `embeddings` holding every template, where
+    students[i] owns rows offsets[i]:offsets[i + 1], plus its manifest.
+    """
+
+    def __init__(self, embeddings, students, manifest):
+        self.embeddings = embeddings
+        self.students = students      # [{'_id' (as str), 'studentId', 'name', 'branch', 'photoUrl', 'templates' (count)}]
+        self.manifest = manifest
+        counts = np.array([s['templates'] for s in students], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    @property
+    def last_updated_at(self):
+        value = self.manifest.get('last_updated_at')
+        return datetime.fromisoformat(value) if value else None
+
+
+# --------------------------------------------------
+# Quantization
+# --------------------------------------------------
+
+def quantize(embeddings, dtype):
+    """Returns (stored matrix, per-row scales or None)."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == 'float32':
+        return embeddings, None
+    if dtype == 'float16':
+        return embeddings.astype(np.float16), None
+    if dtype == 'int8':
+        # symmetric per-row scale keeps every row's full int8 range
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        q = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+        return q, scales.astype(np.float32)
+    raise ValueError(f"Unknown snapshot dtype '{dtype}'. Choose one of: {', '.join(SNAPSHOT_DTYPES)}")
+
+
+def dequantize(stored, scales):
+    if stored.dtype == np.float32:
+        return stored
+    embeddings = stored.astype(np.float32)
+    if scales is not None:
+        embeddings *= scales[:, None]
+    return embeddings
+
+
+# --------------------------------------------------
+# Writing
+# --------------------------------------------------
+
+def writeSnapshot(students, path=SNAPSHOT_DIR, dtype='float32'):
+    """
+    Write student documents (any iterable, e.g. a Mongo cursor) as a snapshot.
+
+    Data files carry the snapshot version in their name and the manifest is
+    replaced last, so a reader never sees a half-written snapshot. Files of
+    the previous snapshot are removed afterwards.
+    """
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"Unknown snapshot dtype '{dtype}'. Choose one of: {', '.join(SNAPSHOT_DTYPES)}")
+    os.makedirs(path, exist_ok=True)
+
+    rows = []
+    table = []
+    last_updated_at = None
+    for s in students:
+        templates = studentTemplates(s)
+        if not templates or 'studentId' not in s:
+            continue
+        rows.extend(templates)
+        table.append({
+            '_id': str(s['_id']),
+            'studentId': s['studentId'],
+            'name': s.get('name'),
+            'branch': s.get('branch'),
+            'photoUrl': s.get('photoUrl'),
+            'templates': len(templates)
+        })
+        if s.get('updatedAt') and (last_updated_at is None or s['updatedAt'] > last_updated_at):
+            last_updated_at = s['updatedAt']
+
+    embeddings = np.asarray(rows, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    stored, scales = quantize(embeddings, dtype)
+
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    files = {
+        'embeddings': f'embeddings-{version}.{dtype}',
+        'students': f'students-{version}.json'
+    }
+    stored.tofile(os.path.join(path, files['embeddings']))
+    if scales is not None:
+        files['scales'] = f'scales-{version}.float32'
+        scales.tofile(os.path.join(path, files['scales']))
+    with open(os.path.join(path, files['students']), 'w') as f:
+        json.dump(table, f)
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'created_at': datetime.utcnow().isoformat(),
+        'last_updated_at': last_updated_at.isoformat() if last_updated_at else None,
+        'dtype': dtype,
+        'count': len(table),
+        'templates': len(rows),
+        'dim': EMBEDDING_DIM,
+        'files': files
+    }
+    previous = _read_manifest(path)
+    tmp = os.path.join(path, MANIFEST_NAME + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(path, MANIFEST_NAME))
+
+    if previous is not None:
+        for name in previous.get('files', {}).values():
+            try:
+                os.remove(os.path.join(path, name))
+            except FileNotFoundError:
+                pass
+    return manifest
+
+
+def syncSnapshot(collection, path=SNAPSHOT_DIR, dtype='float32', batch_size=1000):
+    """Dump the students collection to a snapshot."""
+    cursor = collection.find({}, SNAPSHOT_PROJECTION, batch_size=batch_size)
+    return writeSnapshot(cursor, path, dtype)
+
+
+# --------------------------------------------------
+# Loading
+# --------------------------------------------------
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def loadSnapshot(path=SNAPSHOT_DIR):
+    """Memory-map a snapshot. Returns None if there is none or it can't be used."""
+    manifest = _read_manifest(path)
+    if manifest is None:
+        return None
+    if manifest.get('format') != SNAPSHOT_FORMAT or manifest.get('dim') != EMBEDDING_DIM:
+        logger.warning('Ignoring gallery snapshot %s: format %s, dim %s',
+                       path, manifest.get('format'), manifest.get('dim'))
+        return None
+
+    files = manifest['files']
+    count = manifest['templates']
+    with open(os.path.join(path, files['students'])) as f:
+        students = json.load(f)
+    if count == 0:
+        return Snapshot(np.zeros((0, EMBEDDING_DIM), dtype=np.float32), students, manifest)
+
+    stored = np.memmap(os.path.join(path, files['embeddings']), dtype=manifest['dtype'],
+                       mode='r', shape=(count, EMBEDDING_DIM))
+    scales = None
+    if 'scales' in files:
+        scales = np.fromfile(os.path.join(path, files['scales']), dtype=np.float32)
+    # float32 stays a zero-copy view of the mapped file; quantized rows are expanded once
+    embeddings = np.asarray(dequantize(stored, scales))
+    return Snapshot(embeddings, students, manifest)
+
+
+def deltaQuery(snapshot):
+    """Mongo filter for students written since the snapshot was taken."""
+    if snapshot.last_updated_at is None:
+        return {}
+    return {'updatedAt': {'$gte': snapshot.last_updated_at - CLOCK_SKEW}}
@@ -0,0 +1,35 @@
+"""
+Write the students collection to a compact on-disk gallery snapshot.
+
+The camera process memory-maps the snapshot at startup instead of pulling
+every embedding from Mongo, then fetches only students changed since it.
+Re-run this (e.g. nightly from cron) to keep the delta small.
+
+Usage: python sync_gallery.py [--out gallery_snapshot] [--dtype float32|float16|int8]
+"""
+import argparse
+import os
+import time
+
+import snapshot_utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--out', default=snapshot_utils.SNAPSHOT_DIR, help='snapshot directory')
+    parser.add_argument('--dtype', choices=snapshot_utils.SNAPSHOT_DTYPES, default='float32',
+                        help='on-disk embedding type; float16/int8 are 2x/4x smaller (see bench_snapshot.py)')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    import mongo_utils
+
+    start = time.perf_counter()
+    manifest = snapshot_utils.syncSnapshot(mongo_utils.students_collection, args.out, args.dtype, args.batch_size)
+    size = sum(os.path.getsize(os.path.join(args.out, name)) for name in manifest['files'].values())
+    print(f"Snapshot {manifest['version']}: {manifest['count']} student(s), {manifest['templates']} template(s), "
+          f"{manifest['dtype']}, {size / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,13 @@ from telegram import Bot
 from telegram.utils.request import Request
 
 from dotenv import load_dotenv
+import logging
 import os
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 bot_token = os.getenv('BOT_TOKEN')
 chat_id = os.getenv('CHAT_ID')
 
@@ -20,7 +23,9 @@ def send_alert(caption, photo):
             photo=photo,
             caption=caption,
         )
-        print('Alert sent')
+        logger.debug('Telegram alert sent')
+        return True
     except Exception as e:
-        print(f"Error sending alert: {e}")
+        logger.warning('Error sending telegram alert: %s', e)
+        return False
 
@@ -0,0 +1,140 @@
+import itertools
+import threading
+import time
+
+IOU_THRESHOLD = 0.3         # min overlap for a detection to continue a track
+MAX_GAP = 1.5               # seconds a track may go undetected and still continue (about one sampling interval)
+MAX_IDENTITY_AGE = 10       # seconds an identity is reused before the face is embedded again
+MAX_REUSE_FRAMES = 30       # frames an identity is reused before the face is embedded again
+CONFIDENCE_HALF_LIFE = 10   # seconds for an identity's confidence to halve
+MIN_CONFIDENCE = 0.25       # re-embed a track once its confidence decays below this
+UNKNOWN_CONFIDENCE = 0.5    # unmatched faces are re-checked sooner than matched ones
+
+
+def iou(a, b):
+    """Intersection-over-union of two {'x', 'y', 'w', 'h'} boxes."""
+    x1 = max(a['x'], b['x'])
+    y1 = max(a['y'], b['y'])
+    x2 = min(a['x'] + a['w'], b['x'] + b['w'])
+    y2 = min(a['y'] + a['h'], b['y'] + b['h'])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a['w'] * a['h'] + b['w'] * b['h'] - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.last_seen = now
+        self.last_frame = None   # tracker frame number of the last detection
+        self.missed = False      # went undetected in some frame since its last embedding
+        self.reuses = 0          # frames the identity was reused since the last embedding
+        self.student_id = None
+        self.distance = None
+        self.confidence = 0.0   # identity confidence at the time of the last embedding
+        self.embedded_at = None
+
+    def currentConfidence(self, now):
+        if self.embedded_at is None:
+            return 0.0
+        return self.confidence * 0.5 ** ((now - self.embedded_at) / CONFIDENCE_HALF_LIFE)
+
+
+class FaceTracker:
+    """
+    IoU tracker over detector boxes. Gives each face a track ID and remembers
+    its identity, so a face only needs embedding when it first appears or
+    when its identity confidence has decayed.
+
+    A track only continues into a frame if it was detected in the previous
+    frame or at most `max_gap` seconds ago; otherwise another person stepping
+    into the same spot would inherit its identity. A track that went
+    undetected in any frame is embedded again when it reappears, and an
+    identity is never reused for more than MAX_REUSE_FRAMES frames or
+    MAX_IDENTITY_AGE seconds.
+    """
+
+    def __init__(self, distance_threshold, max_gap=MAX_GAP):
+        self.distance_threshold = distance_threshold
+        self.max_gap = max_gap
+        self.lock = threading.Lock()
+        self.tracks = {}
+        self.ids = itertools.count(1)
+        self.frame = 0
+        self.embeds = 0
+        self.reused = 0
+
+    def update(self, boxes, now=None):
+        """Associate detected boxes with tracks. Returns one Track per box, in order."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.frame += 1
+            # only tracks seen in the previous frame or within max_gap may continue
+            for track_id in [t_id for t_id, t in self.tracks.items()
+                             if t.last_frame != self.frame - 1 and now - t.last_seen > self.max_gap]:
+                del self.tracks[track_id]
+
+            # greedy matching, highest overlap first
+            pairs = []
+            for i, box in enumerate(boxes):
+                for track in self.tracks.values():
+                    overlap = iou(box, track.box)
+                    if overlap >= IOU_THRESHOLD:
+                        pairs.append((overlap, i, track))
+            pairs.sort(key=lambda p: p[0], reverse=True)
+
+            assigned = [None] * len(boxes)
+            used = set()
+            for _, i, track in pairs:
+                if assigned[i] is not None or track.track_id in used:
+                    continue
+                assigned[i] = track
+                used.add(track.track_id)
+
+            for i, box in enumerate(boxes):
+                track = assigned[i]
+                if track is None:
+                    track = Track(next(self.ids), box, now)
+                    self.tracks[track.track_id] = track
+                    assigned[i] = track
+                track.box = box
+                track.last_seen = now
+                track.last_frame = self.frame
+
+            for track in self.tracks.values():
+                if track.last_frame != self.frame:
+                    track.missed = True
+            return assigned
+
+    def needsEmbedding(self, track, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            stale = (
+                track.missed
+                or track.currentConfidence(now) < MIN_CONFIDENCE
+                or now - track.embedded_at > MAX_IDENTITY_AGE
+                or track.reuses >= MAX_REUSE_FRAMES
+            )
+            if not stale:
+                self.reused += 1
+                track.reuses += 1
+            return stale
+
+    def setIdentity(self, track, student_id, distance, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.embeds += 1
+            track.student_id = student_id
+            track.distance = distance
+            track.embedded_at = now
+            track.missed = False
+            track.reuses = 0
+            if student_id is None:
+                track.confidence = UNKNOWN_CONFIDENCE
+            else:
+                track.confidence = max(0.0, 1.0 - distance / self.distance_threshold)
+
+    def stats(self):
+        with self.lock:
+            return {'tracks': len(self.tracks), 'embeds': self.embeds, 'reused': self.reused}